@@ -1,6 +1,7 @@
 import csv, re, time, warnings, argparse, sys
 import pandas as pd
 import numpy as np 
+import io_utils
 
 ### This script should be used to migrate from the raw results
 ### file, generated using the ConvertXMLtoFinalCSV.exe script, 
@@ -36,98 +37,76 @@ def _print_line(line, stageNum, spaceChar):
     print(string.format(line, 'stage ' + str(stageNum) + '/8'))
 
 
-def _read_results(document):
+def _build_event_type_dataframe(et, header, keep, columns):
     
     """
-    Read in the results document using a CSV
-    reader object.
+    Turns the column builders of one
+    event type into a dataframe, with
+    a new 'Event Type' column holding
+    the event type as its value.
     """
     
-    _print_line('Reading results file', 1, '')
-    try:
-        file = open(document, 'r')
-    except:
-        print('\r\nERROR: This is not a valid document. '
-              'Please check your input and try again.')
-        sys.exit(1)
-    reader = csv.reader(file, delimiter=',')
-    data   = []
-    for row in reader:
-        data.append(row)
-    file.close()
+    data = pd.DataFrame(dict(enumerate(columns)))
+    data.columns = [header[idx] for idx in keep]
+    data['Event Type'] = et
     return data
 
 
-def _remove_scoring_section(data):
+def _stream_results(document):
     
     """
-    This removes the scoring section from
-    the results CSV, which is not used
-    in later stages of the analysis.
+    Reads the results document in a single
+    pass. The scoring section at the top
+    (everything up to the first blank line)
+    is skipped, event type section headers
+    are detected on the fly, and every row
+    goes straight into per-column builders
+    for its event type (blank-named columns
+    are never stored). Returns a dictionary
+    with the event type as key and its
+    dataframe as value.
     """
     
-    _print_line('Removing scoring section', 2, '')
-    newData      = []
+    _print_line('Reading results file', 1, '')
+    try:
+        file = open(document, 'r')
+    except:
+        print('\r\nERROR: This is not a valid document. '
+              'Please check your input and try again.')
+        sys.exit(1)
+    builders     = {}
+    eventType    = None
     firstSection = False
-    lineNum      = 0
-    while not firstSection:
-        try:
-            data[lineNum]
-        except:
-            print('\r\nERROR: This document might not be from '
-                  'the correct stage in the results process. '
-                  '\r\nConfirm this is from the stage after '
-                  'using the ConvertXMLtoFinalCSV.exe script.')
-            sys.exit(1)
-        if len(data[lineNum]) == 0:
-            firstSection = True
-        lineNum += 1
-    for line in data[lineNum:]:
-        newData.append(line)
-    return newData
-        
-
-def _create_dict_with_event_type(data):
-    
-    """
-    This breaks the results into chunks,
-    each chunk representing the results
-    from a specific event type. The 
-    event type is stored as a dictionary
-    key, with the value being the results
-    chunk corresponding to that event
-    type.
-    """
-    
-    _print_line('Splitting results by event type', 3, '')
-    newData   = {}
-    eventType = ''
-    for line in data:
-        if len(line) == 1 and '-----' not in line[0]:
-            eventType = line[0]
-            newData[eventType] = []
-        elif len(line) > 1:
-            newData[eventType].append(line)
-    return newData
-
-
-def _create_df_for_each_event_type(dataDict):
-    
-    """
-    Migrates the results chunks for each
-    event type into dataframes. Again, the
-    dictionary key is the event type and the
-    value is the dataframe. Each dataframe is
-    then given a new column, which contains
-    the event type as its value. The column
-    is located in the second position (after
-    'Main Company').
-    """
-    
+    with file:
+        for line in csv.reader(file, delimiter=','):
+            if not firstSection:
+                if len(line) == 0:
+                    firstSection = True
+                    _print_line('Removing scoring section', 2, '')
+                    _print_line('Splitting results by event type', 3, '')
+                continue
+            if len(line) == 1 and '-----' not in line[0]:
+                eventType = line[0]
+                builders[eventType] = None
+            elif len(line) > 1:
+                if builders[eventType] is None:
+                    keep = [idx for idx, name in enumerate(line) if name != '']
+                    builders[eventType] = (line, keep, [[] for idx in keep])
+                    continue
+                header, keep, columns = builders[eventType]
+                for column, idx in zip(columns, keep):
+                    column.append(line[idx])
+    if not firstSection:
+        print('\r\nERROR: This document might not be from '
+              'the correct stage in the results process. '
+              '\r\nConfirm this is from the stage after '
+              'using the ConvertXMLtoFinalCSV.exe script.')
+        sys.exit(1)
     newData = {}
-    for et, data in dataDict.items():
-        newData[et]               = pd.DataFrame(columns=data[0], data=data[1:]).drop(columns=[''])
-        newData[et]['Event Type'] = et
+    for et in list(builders):
+        builder = builders.pop(et)
+        if builder is not None:
+            newData[et] = _build_event_type_dataframe(et, *builder)
     return newData
     
 
@@ -138,30 +117,28 @@ def _merge_dataframes(dataDict):
     type dataframes into one large dataframe.
     Contains language to avoid issues that
     arrise when individual event types have 
-    duplicate slot columns.
+    duplicate slot columns: repeated slot
+    columns are renamed with _N in one pass,
+    all event types are concatenated at
+    once, and the _N columns are coalesced
+    into their base column column-wise.
     """
     
     _print_line('Merging event types into single dataframe', 4, '')
-    newData = pd.DataFrame()
+    frames = []
     for et, data in dataDict.items():
-        data.rename(columns={data.columns[1]: 'Article Date'}, inplace=True)
-        colNames = pd.Series(data.columns)
-        for dup in data.columns[data.columns.duplicated()].unique():
-            i = 0
-            for d_idx in range(len(data.columns.values)):
-                if data.columns.get_loc(dup)[d_idx]:
-                    if i > 0:
-                        colNames[d_idx] = colNames[d_idx] + '_'+ str(i)
-                    i += 1
-        data.columns = colNames
-        newData = newData.append(data, sort=False, ignore_index=True)
-    newData.replace(r'^\s*$', pd.np.nan, regex=True, inplace=True)
+        data = data.rename(columns={data.columns[1]: 'Article Date'})
+        data.columns = io_utils.dedupe_column_names(data.columns)
+        frames.append(data)
+    newData = pd.concat(frames, sort=False, ignore_index=True)
+    newData = newData.replace(r'^\s*$', np.nan, regex=True)
     #print(newData.apply(lambda x: x.isnull().sum(), axis='rows'))
     for column in newData.filter(regex=(r'_[0-9]+$')).columns:
-        baseET = re.findall(r'^([^_]*)_[0-9]+$', column)[0]
-        newData[baseET].fillna(newData[column], inplace=True)
-        
-        newData.loc[newData[column] == newData[baseET], column] = pd.np.nan
+        baseET = re.sub(r'_[0-9]+$', '', column)
+        if baseET not in newData.columns:
+            continue
+        newData[baseET] = newData[baseET].fillna(newData[column])
+        newData[column] = newData[column].mask(newData[column] == newData[baseET])
     #print(newData.apply(lambda x: x.isnull().sum(), axis='rows'))
     newData = newData.rename(columns=lambda x: re.sub(r'_[0-9]+$', '', x))
     goodCols = ['Main Company','Article Date','Event Type','Event Target','Extraction','Polarity','Other','Sentence','URL','Sentence(Inc. Annotations)']
@@ -215,6 +192,24 @@ def _remove_dashes_from_sentence_start(data):
     return data
     
 
+def _parse_other_values(other):
+    
+    """
+    Parses every 'Other' cell once into
+    a wide table of slot -> value (one row
+    per extraction, one column per slot
+    name). Only the first value of a slot
+    in a cell is kept.
+    """
+    
+    pairs = other.fillna('').astype(str).str.findall(r'([A-Za-z]+):"([^"]*)"').explode().dropna()
+    if len(pairs) == 0:
+        return pd.DataFrame(index=other.index)
+    slots = pd.DataFrame(pairs.tolist(), index=pairs.index, columns=['Slot', 'Value'])
+    slots = slots.rename_axis('Row').reset_index().drop_duplicates(subset=['Row', 'Slot'], keep='first')
+    return slots.pivot(index='Row', columns='Slot', values='Value').reindex(other.index)
+
+
 def _pull_other_entity_values(data, option):
     
     """
@@ -222,41 +217,34 @@ def _pull_other_entity_values(data, option):
     from the 'Other' column into their
     respective columns iff that cell
     was blank. Temporarily renames 
-    identical column names with _X, where
-    X = column index, then replaces the
-    names back to their original form.
+    identical column names with _X, 
+    then replaces the names back to
+    their original form. The 'Other'
+    column is parsed only once, and
+    each slot column is then filled
+    by lookup.
     """
     
     if not option:
         _print_line('SKIPPING "Other" column values', 6, ':')
         return data
     _print_line('Pulling extra slot values from "Other" column', 6, '')
-    colNames = pd.Series(data.columns)
-    for dup in data.columns[data.columns.duplicated()].unique():
-        print(dup)
-        colNames[data.columns.get_loc(dup)] = [dup+'_'+str(d_idx) if d_idx!=0 
-                 else dup for d_idx in range(len(data.columns.values))]
+    colNames     = pd.Series(io_utils.dedupe_column_names(data.columns))
     data.columns = colNames
-    startIdx     = ['Polarity', 'Extraction', 'Event Target', 'Event Type']
-    for option in startIdx:
-        if option not in data.columns.values:
-            startIdx.remove(option)
-    polIdx = colNames[colNames == startIdx[0]].index[0]
-    try:
-        otherIdx = colNames[colNames == 'Other'].index[0]
-    except KeyError:
+    startIdx     = [option for option in ['Polarity', 'Extraction', 'Event Target', 'Event Type'] if option in data.columns.values]
+    polIdx       = colNames[colNames == startIdx[0]].index[0]
+    if 'Other' not in data.columns.values:
         print('\r\nERROR: There is no "Other" column...')
         data = data.rename(columns=lambda x: re.sub(r'_[0-9]+$', '', x))
         return data
+    otherIdx = colNames[colNames == 'Other'].index[0]
+    slots    = _parse_other_values(data['Other'])
     for column in colNames[polIdx+1:otherIdx]:
-        colRegex = re.findall(r'([A-Za-z]+)[_0-9]*$', column)[0]
-        regex = re.compile(colRegex + ':"([^"]*)"')
-        try:
-            data[column] = pd.np.where(data['Other'].str.contains(regex) 
-                            & data[column].str.contains(r'^$'), 
-                            data['Other'].str.extract(regex, expand=False), data[column])
-        except AttributeError:
+        slot = re.findall(r'([A-Za-z]+)[_0-9]*$', column)
+        if not slot or slot[0] not in slots.columns:
             continue
+        blank = data[column].isna() | data[column].astype(str).str.strip().eq('')
+        data[column] = data[column].mask(blank, slots[slot[0]])
     data = data.rename(columns=lambda x: re.sub(r'_[0-9]+$', '', x))
     return data
 
@@ -271,22 +259,52 @@ def _delete_blank_columns(data):
     """
     
     _print_line('Deleting blank columns and duplicate slot values', 7, '')
-    data.replace('', pd.np.nan, inplace=True)
+    data.replace('', np.nan, inplace=True)
     data.dropna(axis='columns', how='all', inplace=True)
     return data
 
 
-def _write_document(data, document):
+def _clean_results(data, pullOtherValues=False):
+    
+    """
+    Runs the cleaning stages (5 to 7) on
+    the merged dataframe.
+    """
+    
+    data = _add_neutral_polarity(data)                              # adds 'NEUTRAL' to the 'Polarity' column
+    data = _remove_dashes_from_sentence_start(data)                 # removes "-"s from the beginning of sentences
+    data = _pull_other_entity_values(data, pullOtherValues)         # pull slot values from 'Other' column
+    data = _delete_blank_columns(data)                              # delete slot columns containing no values 
+    return data
+
+
+def _convert_results(document, pullOtherValues=False):
+    
+    """
+    Runs stages 1 to 7 on a results
+    document and returns the final
+    dataframe without writing it.
+    """
+    
+    data = _stream_results(document)                                # read data, skipping the scoring section, into one DataFrame per event type
+    data = _merge_dataframes(data)                                  # merge all individual DataFrames into one
+    return _clean_results(data, pullOtherValues)
+
+
+def _write_document(data, document, formats=('csv',)):
     
     """
     Writes the final document. It uses the
     same name as the original results, plus
-    '_final' at the end.
+    '_final' at the end. Parquet / Feather
+    copies can be written alongside (or
+    instead of) the CSV, and are read
+    directly by the scoring scripts.
     """
     
     _print_line('Writing document', 8, '')
     document = document[:-4] + '_final.csv'
-    data.to_csv(document, index=False, quoting=csv.QUOTE_ALL)
+    io_utils.write_frame(data, document, formats)
     
     
     
@@ -301,20 +319,13 @@ if __name__ == '__main__':
     parser    = argparse.ArgumentParser(description='Converts the results CSV file into a more user-friendly CSV file.')
     parser.add_argument('Document', help='The results document to convert (.csv).')
     parser.add_argument('-pullothervalues', action='store_true', help='Pull slot values from "Other" column to their respective columns (defualt FALSE).')
+    parser.add_argument('-format', nargs='+', choices=io_utils.OUTPUT_FORMATS, default=['csv'], help='Output format(s) for the final document (default csv).')
     args      = parser.parse_args()
     
     startTime = time.perf_counter()
     
-    data      = _read_results(args.Document)                            # read data from document
-    data      = _remove_scoring_section(data)                           # remove the top scoring data
-    data      = _create_dict_with_event_type(data)                      # break results into chunks corresponding to event type
-    data      = _create_df_for_each_event_type(data)                    # convert from array to pandas DataFrame for each event type
-    data      = _merge_dataframes(data)                                 # merge all individual DataFrames into one
-    data      = _add_neutral_polarity(data)                             # adds 'NEUTRAL' to the 'Polarity' column
-    data      = _remove_dashes_from_sentence_start(data)                # removes "-"s from the beginning of sentences
-    data      = _pull_other_entity_values(data, args.pullothervalues)   # pull slot values from 'Other' column
-    data      = _delete_blank_columns(data)                             # delete slot columns containing no values 
+    data      = _convert_results(args.Document, args.pullothervalues)   # read, merge and clean the results
     #print(data.apply(lambda x: x.isnull().sum(), axis='rows'))
-    _write_document(data, args.Document)                                # write final document
+    _write_document(data, args.Document, args.format)                   # write final document
     
     print(f'\r\nAll done; finished in {str(round(time.perf_counter() - startTime,2))} seconds.')
\ No newline at end of file
@@ -0,0 +1,271 @@
+import csv, re, time, argparse, sys
+import pandas as pd
+import numpy as np
+from lxml import etree
+import conversionMacro, io_utils, scoring_utils
+
+### This script replaces the ConvertXMLtoFinalCSV.exe + conversionMacro.py
+### steps of the batch process: it reads the raw SABatchProcessor results
+### (corp_xmlresults.csv) and builds the final extraction table directly,
+### without writing and re-parsing the intermediate results CSV.
+### Conversion: CSV (XML) -> CSV / Parquet / Feather
+###
+### The layout of corp_xmlresults.csv is configurable, as it depends on
+### the corpus given to SABatchProcessor. The defaults assume:
+###   - the annotated document XML is in column 6 (as writeET.py reads it),
+###     possibly with its tags escaped as &lt; / &gt;;
+###   - the main company, article date and URL are in columns 1, 2 and 3;
+###   - sentences are <sentence> elements, and extractions are the
+###     TRUEEVENT_<Event_Type>[_P|_N|_X] elements inside them;
+###   - slot values are either prop_<slot> attributes of the event element
+###     or the text of a child element named after the slot.
+### Rows whose XML column does not look like XML (e.g. a header) are skipped.
+
+""" Polarity suffixes of the TRUEEVENT tags; anything else is left blank (neutral). """
+POLARITIES  = {'P': 'POSITIVE', 'N': 'NEGATIVE'}
+EVENT_REGEX = re.compile(r'^TRUEEVENT_(.+?)(?:_([NPX]))?$')
+
+
+def _read_event_types(document):
+
+    """
+    Reads an eventtypes.txt file into a
+    dictionary with the event type as
+    key and its list of slot names as
+    value (the first comma separated
+    field of each line is the event
+    type, the rest are its slots).
+    """
+
+    eventTypes = {}
+    with open(document, 'r') as doc:
+        for line in doc:
+            fields = [field.strip() for field in line.split(',')]
+            if fields[0] == '':
+                continue
+            slots = eventTypes.setdefault(fields[0], [])
+            slots.extend(slot for slot in fields[1:] if slot != '' and slot not in slots)
+    return eventTypes
+
+
+def _read_companies(document):
+
+    """
+    Reads the filtered companies file
+    (one company per line) into a set.
+    """
+
+    if document is None:
+        return None
+    with open(document, 'r') as doc:
+        return {line.strip() for line in doc if line.strip() != ''}
+
+
+def _clean_xml(xml):
+
+    """
+    Unescapes the document XML and fixes
+    the unquoted attribute values and bare
+    ampersands that keep it from parsing.
+    """
+
+    xml = xml.replace('&lt;', '<').replace('&gt;', '>').replace('&quot;', '"')
+    xml = re.sub(r'<[^<>]+>', lambda tag: re.sub(r'=([^\s"\'>]+)', r'="\1"', tag.group(0)), xml)
+    xml = re.sub(r'&(?!(?:amp|lt|gt|quot|apos|#[0-9]+);)', '&amp;', xml)
+    return xml
+
+
+def _parse_document(xml):
+
+    """
+    Parses one annotated document, wrapped
+    in a root element so that documents
+    with several top level sentences parse.
+    Returns None if nothing can be parsed.
+    """
+
+    parser = etree.XMLParser(recover=True, huge_tree=True)
+    try:
+        return etree.fromstring('<document>' + _clean_xml(xml) + '</document>', parser)
+    except etree.XMLSyntaxError:
+        return None
+
+
+def _slot_value(elem, slot):
+
+    """
+    Returns the value of a slot for an
+    event element: its prop_<slot>
+    attribute, or else the text of the
+    first child element named <slot>.
+    """
+
+    value = elem.get('prop_' + slot)
+    if value is not None:
+        return value
+    child = elem.find('.//' + slot)
+    if child is not None:
+        return ''.join(child.itertext())
+    return ''
+
+
+def _other_values(elem, slots, targetType):
+
+    """
+    Lists the tagged entities of an event
+    that have no slot column, as the
+    Slot:"value" pairs of the 'Other'
+    column.
+    """
+
+    pairs = []
+    for child in elem.iter():
+        if child is elem or not isinstance(child.tag, str) or child.tag in slots or child.tag == targetType:
+            continue
+        pairs.append('{}:"{}"'.format(child.tag, ''.join(child.itertext())))
+    return ' '.join(pairs)
+
+
+def _sentence_xml(sentence):
+
+    """
+    Returns a sentence as the annotated
+    string the scoring scripts expect,
+    with ampersands left unescaped.
+    """
+
+    return etree.tostring(sentence, encoding=str, with_tail=False).replace('&amp;', '&')
+
+
+def _extract_rows(root, row, eventTypes, options):
+
+    """
+    Yields one output row for every
+    TRUEEVENT of a wanted event type in
+    the document, in the column order of
+    the final table.
+    """
+
+    sentences = root.iter(options.sentencetag) if root.find('.//' + options.sentencetag) is not None else [root]
+    for sentence in sentences:
+        text = None
+        for elem in sentence.iter():
+            if not isinstance(elem.tag, str):
+                continue
+            match = EVENT_REGEX.match(elem.tag)
+            if match is None:
+                continue
+            eventType = match.group(1).replace('_', ' ')
+            slots     = eventTypes.get(eventType)
+            if slots is None:
+                continue
+            if text is None:
+                text = (re.sub(r'\s+', ' ', ''.join(sentence.itertext())).strip(), _sentence_xml(sentence))
+            target = elem.find('.//' + options.targetentitytype)
+            yield ([row[options.companycol], row[options.datecol], eventType,
+                    '' if target is None else ''.join(target.itertext()),
+                    scoring_utils.extraction_text(elem),
+                    POLARITIES.get(match.group(2), '')]
+                   + [_slot_value(elem, slot) for slot in slots]
+                   + [_other_values(elem, slots, options.targetentitytype), text[0], row[options.urlcol], text[1]],
+                   slots)
+
+
+def convert(document, eventTypes, companies, options):
+
+    """
+    Converts the raw XML results into the
+    merged extraction table (the columns
+    conversionMacro's _merge_dataframes
+    produces), kept in memory. Companies
+    not in the filter set are dropped,
+    and with options.removeduplicates
+    repeated rows are dropped.
+    """
+
+    conversionMacro._print_line('Reading XML results', 1, '')
+    try:
+        file = open(document, 'r', newline='')
+    except:
+        print('\r\nERROR: This is not a valid document. '
+              'Please check your input and try again.')
+        sys.exit(1)
+    slotCols = list(dict.fromkeys(slot for slots in eventTypes.values() for slot in slots))
+    slotIdx  = {slot: idx for idx, slot in enumerate(slotCols)}
+    columns  = [[] for idx in range(len(slotCols) + 10)]
+    seen     = set()
+    badXml   = 0
+    conversionMacro._print_line('Extracting events', 2, '')
+    with file:
+        for row in csv.reader(file, delimiter=','):
+            if len(row) <= options.xmlcol or '<' not in row[options.xmlcol] and '&lt;' not in row[options.xmlcol]:
+                continue
+            if companies is not None and row[options.companycol] not in companies:
+                continue
+            root = _parse_document(row[options.xmlcol])
+            if root is None:
+                badXml += 1
+                continue
+            for values, slots in _extract_rows(root, row, eventTypes, options):
+                if options.removeduplicates:
+                    key = tuple(values)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                numSlots = len(slots)
+                for column, value in zip(columns[:6], values[:6]):
+                    column.append(value)
+                slotValues = [''] * len(slotCols)
+                for slot, value in zip(slots, values[6:6 + numSlots]):
+                    slotValues[slotIdx[slot]] = value
+                for column, value in zip(columns[6:6 + len(slotCols)], slotValues):
+                    column.append(value)
+                for column, value in zip(columns[6 + len(slotCols):], values[6 + numSlots:]):
+                    column.append(value)
+    if badXml:
+        print('\r\nWARNING: {} documents could not be parsed and were skipped.'.format(badXml))
+    conversionMacro._print_line('Building extraction table', 3, '')
+    names = (['Main Company', 'Article Date', 'Event Type', 'Event Target', 'Extraction', 'Polarity']
+             + slotCols + ['Other', 'Sentence', 'URL', 'Sentence(Inc. Annotations)'])
+    data  = pd.DataFrame(dict(enumerate(columns)))
+    data.columns = names if len(data.columns) else []
+    if data.empty:
+        print('\r\nERROR: No extractions of the listed event types were found...')
+        sys.exit(1)
+    conversionMacro._print_line('Merging event types into single dataframe', 4, '')
+    return data.replace(r'^\s*$', np.nan, regex=True)
+
+
+
+##############################################################################
+##############################################################################
+##############################################################################
+
+
+
+if __name__ == '__main__':
+
+    parser    = argparse.ArgumentParser(description='Converts the raw XML results CSV file into the final, user-friendly CSV file.')
+    parser.add_argument('EventTypes', help='The eventtypes.txt file listing the event types (and their slots) to keep.')
+    parser.add_argument('Document', help='The raw XML results document to convert (corp_xmlresults.csv).')
+    parser.add_argument('-companies', default=None, help='File of companies to keep, one per line (default all).')
+    parser.add_argument('-removeduplicates', action='store_true', help='Remove repeated extraction rows (default FALSE).')
+    parser.add_argument('-pullothervalues', action='store_true', help='Pull slot values from "Other" column to their respective columns (defualt FALSE).')
+    parser.add_argument('-targetentitytype', default='TICKER', help='Entity tag used for the "Event Target" column (default TICKER).')
+    parser.add_argument('-sentencetag', default='sentence', help='Tag of the sentence elements in the XML (default sentence).')
+    parser.add_argument('-xmlcol', type=int, default=6, help='Column of the results holding the document XML (default 6).')
+    parser.add_argument('-companycol', type=int, default=1, help='Column of the results holding the main company (default 1).')
+    parser.add_argument('-datecol', type=int, default=2, help='Column of the results holding the article date (default 2).')
+    parser.add_argument('-urlcol', type=int, default=3, help='Column of the results holding the URL (default 3).')
+    parser.add_argument('-format', nargs='+', choices=io_utils.OUTPUT_FORMATS, default=['csv'], help='Output format(s) for the final document (default csv).')
+    args      = parser.parse_args()
+
+    startTime = time.perf_counter()
+
+    eventTypes = _read_event_types(args.EventTypes)
+    companies  = _read_companies(args.companies)
+    data       = convert(args.Document, eventTypes, companies, args)                    # parse the XML results into the merged DataFrame
+    data       = conversionMacro._clean_results(data, args.pullothervalues)           # stages 5 to 7 of conversionMacro
+    conversionMacro._write_document(data, args.Document[:-4] + '_x.csv', args.format)   # write final document (<results>_x_final)
+
+    print(f'\r\nAll done; finished in {str(round(time.perf_counter() - startTime,2))} seconds.')
@@ -16,45 +16,66 @@ import argparse
 #corp_mf = pd.read_csv(r"C:\Users\Opensesafi\Documents\VIPProjects\STP_Corpus\mf_corp_6426_new.csv")
 #folder_path = r"C:\Users\Opensesafi\Documents\VIPProjects\STP_Corpus\\"
 
-def _read(document):
+def _read_master(document):
     
     """
-    Read in the data.
+    Reads the security master (ticker,
+    short_name, short_desc) once, keyed
+    by ticker.
     """
     
-    print('Reading data...')
-    return pd.read_csv(document, low_memory=False)
+    print('Reading security master...')
+    master = pd.read_csv(document, dtype=str, usecols=['ticker', 'short_name', 'short_desc'])
+    return master.drop_duplicates(subset='ticker').set_index('ticker')
 
-def _add_fund_name(data):
+def _add_fund_name(data, master):
     
     """
     Adds the meta data - name and desc 
     in the first line of the article
-    text. 
+    text. The fund is looked up by the
+    organization name without its
+    [TICKER] prefix.
     """
-    all_names = pd.read_csv(r"C:\Users\Opensesafi\Documents\VIPProjects\STP_Corpus\ticker_name_desc.csv")    
-    ticker_list = data.organization_name.str.replace("\[TICKER\]","").tolist()    
-    data.set_index('organization_name',inplace = True)
-    all_names.set_index('ticker',inplace = True)    
-    for t in ticker_list:
-        if t in all_names.index:
-            x = "[TICKER]"+t
-            data.at[x,'article_text'] = "short_name "+ str(all_names.at[t,'short_name']) + "\n"+ "short_desc "+ str(all_names.at[t,'short_desc']) +" "+ str(data.at[x,'article_text'])
-    return data
-
-
-'''
-ETF Corpus
-'''
-data     = _read(r"C:\Users\Opensesafi\Documents\Python Scripts\Missing prospectus\missing_2020_filelist_VIP_CSV_2020_09_22T10-16_strictclean_processed.csv")
-data     = _add_fund_name(data)
-data.to_csv(r"C:\Users\Opensesafi\Documents\VIPProjects\STP_Corpus\2020_2532.csv", quoting = csv.QUOTE_ALL)
-
-'''
-MF Corpus
-'''
-data     = _read(r"C:\Users\Opensesafi\Documents\VIPProjects\STP_Corpus\mf_corp_6426_new.csv")
-data     = _add_fund_name(data)
-data.to_csv(r"C:\Users\Opensesafi\Documents\VIPProjects\STP_Corpus\mf_corp_w_name.csv")
-
-print('\r\nDONE!')
\ No newline at end of file
+    
+    tickers = data['organization_name'].str.replace('[TICKER]', '', regex=False)
+    found   = tickers.isin(master.index)
+    names   = master.reindex(tickers.values).set_axis(data.index)
+    text    = ('short_name ' + names['short_name'].fillna('') + '\n' + 'short_desc ' + names['short_desc'].fillna('')
+               + ' ' + data['article_text'].fillna(''))
+    data['article_text'] = text.where(found, data['article_text'])
+    return data[['organization_name'] + [column for column in data.columns if column != 'organization_name']]
+
+def _process_corpus(document, output, master, quoting=csv.QUOTE_MINIMAL, chunksize=None):
+    
+    """
+    Adds the fund names to a corpus and
+    writes it out, optionally reading and
+    writing it in chunks of rows.
+    """
+    
+    print('Reading data from {}...'.format(document))
+    chunks = [pd.read_csv(document, dtype=str)] if chunksize is None else pd.read_csv(document, dtype=str, chunksize=chunksize)
+    for chunkNum, data in enumerate(chunks):
+        data = _add_fund_name(data, master)
+        data.to_csv(output, mode='w' if chunkNum == 0 else 'a', header=(chunkNum == 0), index=False, quoting=quoting)
+    print('Written {}'.format(output))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Adds the fund name and description from the security master to the prospectus corpora.')
+    parser.add_argument('--master', required=True, help='Security master with ticker, short_name and short_desc columns (ticker_name_desc.csv).')
+    parser.add_argument('--etf', nargs=2, metavar=('CORPUS', 'OUTPUT'), help='ETF corpus and the document to write it to.')
+    parser.add_argument('--mf', nargs=2, metavar=('CORPUS', 'OUTPUT'), help='MF corpus and the document to write it to.')
+    parser.add_argument('--chunksize', type=int, default=100000, help='Rows per chunk when processing the MF corpus (default 100000).')
+    args   = parser.parse_args()
+    if args.etf is None and args.mf is None:
+        parser.error('give at least one of --etf / --mf')
+    
+    master = _read_master(args.master)
+    if args.etf is not None:
+        _process_corpus(args.etf[0], args.etf[1], master, quoting=csv.QUOTE_ALL)
+    if args.mf is not None:
+        _process_corpus(args.mf[0], args.mf[1], master, chunksize=args.chunksize)
+    
+    print('\r\nDONE!')
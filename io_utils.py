@@ -0,0 +1,201 @@
+import csv, os, sys
+import pandas as pd
+
+"""
+
+Readers and writers shared by the OpenSesafi post-processing scripts
+(conversionMacro.py and the scoring scripts). Besides the usual
+QUOTE_ALL CSVs, frames can be written to Parquet or Feather so the next
+stage can load them without re-parsing text.
+
+"""
+
+
+OUTPUT_FORMATS   = ['csv', 'parquet', 'feather']
+PROFILE_COLUMNS  = {
+        'batch': ['Main Company', 'Article Date', 'Event Type', 'Extraction', 'Sentence', 'Sentence(Inc. Annotations)'],
+        'api':   ['companyName', 'ticker', 'eventDate', 'Event Type', 'eventName', 'properties'],
+        }
+CATEGORY_COLUMNS = ['Event Type']
+
+
+def dedupe_column_names(columns, sep='_'):
+
+    """
+    Renames repeated column names in
+    one pass: the second occurrence of
+    a name gets _1, the third _2, etc.
+    (with sep='.' this matches how
+    pd.read_csv names them).
+    """
+
+    seen     = {}
+    colNames = []
+    for name in columns:
+        count = seen.get(name, 0)
+        colNames.append(name + sep + str(count) if count else name)
+        seen[name] = count + 1
+    return colNames
+
+
+def _columnar_frame(data):
+
+    """
+    Prepares a frame for the columnar
+    formats: duplicate column names get
+    a .N suffix (as pd.read_csv gives
+    them), text columns become
+    string columns and the index is
+    dropped (as it is in the CSVs).
+    """
+
+    data = data.reset_index(drop=True)
+    if data.columns.duplicated().any():
+        data.columns = dedupe_column_names(data.columns, '.')
+    for column in data.columns[data.dtypes == object]:
+        data[column] = data[column].astype('string')
+    return data
+
+
+def write_frame(data, document, formats=('csv',)):
+
+    """
+    Writes the frame in each of the
+    requested formats. The document
+    name is used as is for CSV, and
+    with a .parquet / .feather
+    extension for the others.
+    """
+
+    base = os.path.splitext(document)[0]
+    for fmt in formats:
+        if fmt == 'csv':
+            data.to_csv(base + '.csv', index=False, quoting=csv.QUOTE_ALL)
+            continue
+        try:
+            if fmt == 'parquet':
+                _columnar_frame(data).to_parquet(base + '.parquet', index=False)
+            elif fmt == 'feather':
+                _columnar_frame(data).to_feather(base + '.feather')
+            else:
+                raise ValueError('Unknown output format: {}'.format(fmt))
+        except ImportError:
+            print('\r\nERROR: Writing {} files needs the pyarrow package.'.format(fmt))
+            sys.exit(1)
+
+
+def read_frame(document, **kwargs):
+
+    """
+    Reads a document written by
+    write_frame, choosing the reader
+    from the file extension. Any extra
+    arguments go to pd.read_csv.
+    """
+
+    extension = os.path.splitext(document)[1].lower()
+    if extension == '.parquet':
+        return pd.read_parquet(document)
+    if extension == '.feather':
+        return pd.read_feather(document)
+    return pd.read_csv(document, **kwargs)
+
+
+def read_chunks(document, chunksize, profile=None):
+
+    """
+    Reads a document in chunks of
+    chunksize rows, choosing the reader
+    from the file extension: CSVs are
+    read with pd.read_csv, Parquet by row
+    batches and Feather from a memory
+    mapped table, so no format is loaded
+    whole. With a scoring profile only
+    the columns it needs are read. The
+    row index runs on across chunks.
+    """
+
+    extension = os.path.splitext(document)[1].lower()
+    columns, dtypes = profile_options(document, profile) if profile else (None, None)
+    if extension not in ('.parquet', '.feather'):
+        options = {'usecols': columns, 'dtype': dtypes} if profile else {'low_memory': False}
+        yield from pd.read_csv(document, chunksize=chunksize, **options)
+        return
+    try:
+        if extension == '.parquet':
+            import pyarrow.parquet
+            batches = pyarrow.parquet.ParquetFile(document).iter_batches(batch_size=chunksize, columns=columns)
+        else:
+            import pyarrow.feather
+            batches = pyarrow.feather.read_table(document, columns=columns, memory_map=True).to_batches(max_chunksize=chunksize)
+    except ImportError:
+        print('\r\nERROR: Reading {} files needs the pyarrow package.'.format(extension[1:]))
+        sys.exit(1)
+    categories = {column: 'category' for column in columns or [] if column in CATEGORY_COLUMNS}
+    start      = 0
+    for batch in batches:
+        data       = batch.to_pandas().astype(categories)
+        data.index = pd.RangeIndex(start, start + len(data))
+        start     += len(data)
+        yield data
+
+
+def _header(document):
+
+    """
+    Returns the column names of a
+    document without reading its rows.
+    """
+
+    extension = os.path.splitext(document)[1].lower()
+    if extension == '.parquet':
+        import pyarrow.parquet
+        return pyarrow.parquet.read_schema(document).names
+    if extension == '.feather':
+        import pyarrow.ipc
+        return pyarrow.ipc.open_file(document).schema.names
+    return list(pd.read_csv(document, nrows=0).columns)
+
+
+def profile_options(document, profile):
+
+    """
+    Returns the columns of the document
+    that the scoring profile ('batch' or
+    'api') needs, and the dtypes to read
+    them with: categorical for the low
+    cardinality columns, string for the
+    rest.
+    """
+
+    wanted  = PROFILE_COLUMNS[profile.lower()]
+    columns = [column for column in _header(document) if column in wanted]
+    dtypes  = {column: ('category' if column in CATEGORY_COLUMNS else str) for column in columns}
+    return columns, dtypes
+
+
+def read_projected(document, profile, engine=None):
+
+    """
+    Reads only the columns the scoring
+    profile needs, with typed columns.
+    CSVs can be parsed with the
+    multi-threaded pyarrow engine.
+    """
+
+    columns, dtypes = profile_options(document, profile)
+    categories = {column: 'category' for column in columns if column in CATEGORY_COLUMNS}
+    extension  = os.path.splitext(document)[1].lower()
+    if extension == '.parquet':
+        return pd.read_parquet(document, columns=columns).astype(categories)
+    if extension == '.feather':
+        return pd.read_feather(document, columns=columns).astype(categories)
+    if engine == 'pyarrow':
+        try:
+            import pyarrow
+        except ImportError:
+            print('\r\nWARNING: pyarrow is not installed, using the default CSV engine.')
+            engine = None
+    if engine == 'pyarrow':
+        return pd.read_csv(document, usecols=columns, dtype=dtypes, engine='pyarrow')
+    return pd.read_csv(document, usecols=columns, dtype=dtypes, low_memory=False)
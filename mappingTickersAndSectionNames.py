@@ -1,24 +1,59 @@
 import pandas as pd
-import csv, argparse, re
+import csv, argparse, re, os, functools
 
-def _read(document, docType):
+CHUNKSIZE = 1000000
+
+def _read(document):
     print('Reading...')
-    if docType.lower() == 'corpus':
-        return pd.read_csv(document, low_memory=True, dtype=str, usecols=['organization_name', 'ticker'])
+    return pd.read_csv(document, low_memory=True, dtype=str)
+
+def _read_tickers(documents):
+    chunks = []
+    for document in documents:
+        print('Reading tickers from {}...'.format(document))
+        for chunk in pd.read_csv(document, dtype=str, usecols=['organization_name', 'ticker'], chunksize=CHUNKSIZE):
+            chunks.append(chunk.dropna().drop_duplicates())
+    tickers = pd.concat(chunks, ignore_index=True).drop_duplicates()
+    repeats = tickers['organization_name'].duplicated()
+    if repeats.any():
+        print('WARNING: {} companies have more than one ticker; keeping the first.'.format(repeats.sum()))
+    return tickers[~repeats].reset_index(drop=True)
+
+def _index_is_current(index, documents):
+    sources = index + '.sources'
+    if not os.path.exists(index) or not os.path.exists(sources):
+        return False
+    with open(sources, 'r') as doc:
+        if doc.read().splitlines() != [os.path.abspath(document) for document in documents]:
+            return False
+    return all(os.path.getmtime(document) < os.path.getmtime(index) for document in documents)
+
+def _load_ticker_index(index, documents, rebuild=False):
+    if not rebuild and _index_is_current(index, documents):
+        print('Reusing ticker index {}...'.format(index))
+        tickers = pd.read_csv(index, dtype=str, keep_default_na=False)
     else:
-        return pd.read_csv(document, low_memory=True, dtype=str)
+        tickers = _read_tickers(documents)
+        tickers.to_csv(index, index=False, quoting=csv.QUOTE_ALL)
+        with open(index + '.sources', 'w') as doc:
+            doc.write('\n'.join(os.path.abspath(document) for document in documents) + '\n')
+    return pd.Series(tickers['ticker'].values, index=tickers['organization_name'].values)
 
 def _map_tickers(results, tickers):
     print('Mapping tickers...')
-    results['Ticker'] = pd.merge(results, tickers, left_on=['Main Company'], right_on=['organization_name'])['ticker']
+    results['Ticker'] = results['Main Company'].map(tickers)
     return results
 
+@functools.lru_cache(maxsize=None)
+def _section_pattern(eventType):
+    event = re.escape(re.sub(r'[ ]+', '_', eventType))
+    return re.compile(r'EVENT_' + event + r'[^>]*prop_SectionName="([^"]+)"')
+
 def _extract_section(data):
     print('Mapping sections...')
-    for idx, row in data.iterrows():
-        event  = re.sub(row['Event Type'], r'[ ]+', '_')
-        regexp = re.compile(r'EVENT_' + event + r'[^>]*prop_SectionName="([^"]+)"')
-        data.loc[idx, 'Section Name'] = re.search(regexp, row['Sentence(Inc. Annotations)'])
+    sections = [data.loc[rows, 'Sentence(Inc. Annotations)'].str.extract(_section_pattern(eventType), expand=False)
+                for eventType, rows in data.groupby('Event Type', sort=False).groups.items()]
+    data['Section Name'] = pd.concat(sections) if sections else pd.Series(dtype=object)
     return data
 
 def _write(document, data):
@@ -29,20 +64,16 @@ def _write(document, data):
 if __name__ == '__main__':
     args       = argparse.ArgumentParser(description='Adds tickers and section names to OpenSeSaFi results.')
     args.add_argument('--results', dest='ResultsDoc', required=True, help='Final results document (after macro).')
-    args.add_argument('--corpus1', dest='CorpusDoc1', required=True, help='First corpus document.')
-    #args.add_argument('--corpus2', dest='CorpusDoc2', required=True, help='Second corpus document.')
+    args.add_argument('--corpus', '--corpus1', dest='CorpusDocs', nargs='+', required=True, help='Corpus document(s) to take the tickers from.')
+    args.add_argument('--index', dest='IndexDoc', help='Ticker index to build / reuse (default ticker_index.csv next to the results).')
+    args.add_argument('--rebuild', action='store_true', help='Rebuild the ticker index even if it is up to date.')
     params     = args.parse_args()
     resultsDoc = params.ResultsDoc
-    corpusDoc1 = params.CorpusDoc1
-    #corpusDoc2 = params.CorpusDoc2
+    indexDoc   = params.IndexDoc or os.path.join(os.path.dirname(os.path.abspath(resultsDoc)), 'ticker_index.csv')
     
-    resultsData = _read(resultsDoc, 'Results')
-    corpusData1 = _read(corpusDoc1, 'Corpus')
-    #corpusData2 = _read(corpusDoc2, 'Corpus')
-    tickerData  = corpusData1.drop_duplicates().reset_index(drop=True)
-    #tickerData  = corpusData1.append(corpusData2).drop_duplicates().reset_index(drop=True)
+    resultsData = _read(resultsDoc)
+    tickerData  = _load_ticker_index(indexDoc, params.CorpusDocs, params.rebuild)
     
     resultsData = _map_tickers(resultsData, tickerData)
     resultsData = _extract_section(resultsData)
-    _write('{}_wTickers.csv'.format(resultsDoc[:-4]), resultsData)
-    
\ No newline at end of file
+    _write('{}_wTickers.csv'.format(resultsDoc[:-4]), resultsData)
\ No newline at end of file
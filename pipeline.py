@@ -0,0 +1,142 @@
+import re, time, argparse, importlib
+import conversionMacro, convertXMLResults, io_utils, scoring_utils, stage_cache
+
+### This script runs the post-processing chain of Process.txt in a single
+### process: the results are converted (conversionMacro.py, or
+### convertXMLResults.py when starting from the raw XML results) and the
+### final dataframe is handed straight to the chosen scoring script, so the
+### intermediate _final document is neither written nor re-read unless it
+### is asked for. With -cache, the output of the conversion and of the XML
+### parse are kept (as Parquet) and reused while their inputs are unchanged,
+### so e.g. a change of weights only re-runs the stages after the parse.
+### Conversion: CSV -> score documents (CSV / Parquet / Feather)
+
+SCORERS         = ['score_STP', 'scoreOSFIdata', 'scoreOSFIdata_with_text_extraction']
+CONVERT_OPTIONS = ['pullothervalues', 'targetentitytype', 'sentencetag', 'xmlcol', 'companycol', 'datecol', 'urlcol', 'removeduplicates']
+
+
+def _intermediate_document(args):
+
+    """
+    Returns the name of the converted
+    results document, before the
+    '_final' suffix.
+    """
+
+    if args.eventtypes is None:
+        return args.Document
+    return args.Document[:-4] + '_x.csv'
+
+
+def _convert(args):
+
+    """
+    Runs the conversion stages and
+    returns the final dataframe.
+    """
+
+    if args.eventtypes is None:
+        data = conversionMacro._convert_results(args.Document, args.pullothervalues)
+    else:
+        eventTypes = convertXMLResults._read_event_types(args.eventtypes)
+        companies  = convertXMLResults._read_companies(args.companies)
+        data       = convertXMLResults.convert(args.Document, eventTypes, companies, args)
+        data       = conversionMacro._clean_results(data, args.pullothervalues)
+    if args.keepintermediate:
+        conversionMacro._write_document(data, _intermediate_document(args), args.format)
+    data.columns = io_utils.dedupe_column_names(data.columns, '.')     # repeated slot columns, named as when the document is read back
+    return data
+
+
+def _convert_stage(args):
+
+    """
+    Returns the converted results, from
+    the stage cache if the results file,
+    the eventtypes and companies files
+    and the conversion options are the
+    same as in an earlier run. Also
+    returns the stage's cache key.
+    """
+
+    if args.cache is None:
+        return _convert(args), None
+    key  = stage_cache.fingerprint('convert', document=stage_cache.file_hash(args.Document),
+                                   eventtypes=stage_cache.file_hash(args.eventtypes), companies=stage_cache.file_hash(args.companies),
+                                   options={option: getattr(args, option) for option in CONVERT_OPTIONS})
+    data = stage_cache.load(args.cache, key)
+    if data is None:
+        data = _convert(args)
+        stage_cache.store(args.cache, key, data, args.cachesize * 1024 * 1024)
+    else:
+        print('Reusing the cached conversion of {}'.format(args.Document))
+        if args.keepintermediate:
+            conversionMacro._write_document(data.rename(columns=lambda x: re.sub(r'\.[0-9]+$', '', x)), _intermediate_document(args), args.format)
+    return data, key
+
+
+def _topics_stage(args, scorer, data, topics, sourceKey):
+
+    """
+    Returns the topic hits of the scoring
+    script (before weights), from the
+    stage cache if the converted results,
+    the scoring script, its topic list
+    and the extractor are the same as in
+    an earlier run.
+    """
+
+    if args.cache is None:
+        return scorer._score_topics(data, topics, 'Batch', args.workers, args.extractor)
+    key    = stage_cache.fingerprint('topics', source=sourceKey, scorer=args.scorer, topics=topics, extractor=args.extractor)
+    scored = stage_cache.load(args.cache, key)
+    if scored is None:
+        scored = scorer._score_topics(data, topics, 'Batch', args.workers, args.extractor)
+        stage_cache.store(args.cache, key, scored, args.cachesize * 1024 * 1024)
+    else:
+        print('Reusing the cached topic hits for {}'.format(args.scorer))
+    return scored
+
+
+##############################################################################
+##############################################################################
+##############################################################################
+
+
+
+if __name__ == '__main__':
+
+    parser    = argparse.ArgumentParser(description='Converts and scores a results file in one process.')
+    parser.add_argument('Document', help='The results document: the ConvertXMLtoFinalCSV.exe output, or the raw XML results with -eventtypes.')
+    parser.add_argument('-scorer', choices=SCORERS, default='score_STP', help='Scoring script to run on the converted results (default score_STP).')
+    parser.add_argument('-eventtypes', default=None, help='Start from the raw XML results (corp_xmlresults.csv), keeping the event types in this eventtypes.txt file.')
+    parser.add_argument('-keepintermediate', action='store_true', help='Also write the converted (_final) document (default FALSE).')
+    parser.add_argument('-pullothervalues', action='store_true', help='Pull slot values from "Other" column to their respective columns (defualt FALSE).')
+    parser.add_argument('-aggregation', choices=scoring_utils.AGGREGATIONS, default=None, help='How topic scores are aggregated per company and date (default that of the scoring script).')
+    parser.add_argument('-weights', default=None, help='JSON file of event type weights (score_STP only).')
+    parser.add_argument('-incremental', metavar='STORE', default=None, help='SQLite aggregate store to update (score_STP only).')
+    parser.add_argument('-workers', type=int, default=1, help='Number of processes used to parse the XML when scoring (default 1).')
+    parser.add_argument('-extractor', choices=scoring_utils.EXTRACTORS, default='lxml', help='How the TRUEEVENTs are read from the annotated sentences (lxml or stream, default lxml).')
+    parser.add_argument('-format', nargs='+', choices=io_utils.OUTPUT_FORMATS, default=['csv'], help='Output format(s) for the written documents (default csv).')
+    for option, default in [('-companies', None), ('-targetentitytype', 'TICKER'), ('-sentencetag', 'sentence')]:
+        parser.add_argument(option, default=default, help='As in convertXMLResults.py (with -eventtypes only).')
+    for option, default in [('-xmlcol', 6), ('-companycol', 1), ('-datecol', 2), ('-urlcol', 3)]:
+        parser.add_argument(option, type=int, default=default, help='As in convertXMLResults.py (with -eventtypes only).')
+    parser.add_argument('-cache', default=None, help='Directory in which to cache the conversion and XML parse stages (default no cache).')
+    parser.add_argument('-cachesize', type=int, default=2048, help='Size limit of the stage cache in MB (default 2048).')
+    parser.add_argument('-removeduplicates', action='store_true', help='As in convertXMLResults.py (with -eventtypes only).')
+    args      = parser.parse_args()
+
+    startTime = time.perf_counter()
+
+    scorer    = importlib.import_module(args.scorer)
+    if args.aggregation is None:
+        args.aggregation = scorer.DEFAULT_AGGREGATION
+    data, key = _convert_stage(args)                                # results -> final dataframe, in memory
+    doc       = _intermediate_document(args)[:-4] + '_final.csv'
+    print('\r\nScoring with {}...'.format(args.scorer))
+    topics    = scorer._init_topics()
+    data      = _topics_stage(args, scorer, data, topics, key)      # final dataframe -> topic hits
+    scorer._score_from_topics(data, topics, doc, 'Batch', args)     # topic hits -> score documents
+
+    print(f'\r\nAll done; finished in {str(round(time.perf_counter() - startTime,2))} seconds.')
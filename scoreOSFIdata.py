@@ -1,7 +1,6 @@
-import pandas as pd
-import re, csv, argparse, sys, ast
-from lxml import etree
-from itertools import chain
+import numpy as np
+import re, argparse, sys, os
+import scoring_utils, io_utils
 
 """
 
@@ -15,14 +14,21 @@ Last updated: Kevin Ludwig, 12/17/2018
 """
 
 
-def _read(document):
+DEFAULT_AGGREGATION = 'sum'
+
+
+def _read(document, profile=None, engine=None):
     
     """
-    Read in the data.
+    Read in the data. If a scoring
+    profile ('batch' or 'api') is given,
+    only the columns it needs are read.
     """
     
     print('Reading data...')
-    return pd.read_csv(document, low_memory=False)
+    if profile:
+        return io_utils.read_projected(document, profile, engine)
+    return io_utils.read_frame(document, low_memory=False)
     
 
 def _init_topics():
@@ -93,27 +99,13 @@ def _format_xmls_correctly(data):
     """
     
     print('Formatting XML language...')
-    data['Sentence(Inc. Annotations)'] = data['Sentence(Inc. Annotations)'].str.replace(r"(=)([a-z0-9_]+)", r"\1'\2'")
+    data['Sentence(Inc. Annotations)'] = data['Sentence(Inc. Annotations)'].str.replace(r"(=)([a-z0-9_]+)", r"\1'\2'", regex=True)
     data['Sentence(Inc. Annotations)'] = data['Sentence(Inc. Annotations)'].str.replace(r'&', '&amp;')
-    data['Sentence(Inc. Annotations)'] = data['Sentence(Inc. Annotations)'].str.replace(r'<\/?sa\.irrelevant\.rule>', '')
+    data['Sentence(Inc. Annotations)'] = data['Sentence(Inc. Annotations)'].str.replace(r'<\/?sa\.irrelevant\.rule>', '', regex=True)
     return data
     
 
-def _stringify_children(node):
-    
-    """
-    Used in the _add_scores_to_topic_columns
-    function. Turns the extraction XML
-    data into a single string, regardless
-    of whether there are slots (or other
-    tagged data) within the string.
-    """
-    
-    parts = ([node.text] + list(chain(*([etree.tostring(c, encoding=str, with_tail=False), c.tail] for c in node.getchildren()))))
-    return ''.join(filter(None, parts))
-
-
-def _add_scores_to_topic_columns(data, docType):
+def _add_scores_to_topic_columns(data, docType, workers=1, extractor='lxml'):
     
     """
     Matches up the extraction to the correct
@@ -122,31 +114,25 @@ def _add_scores_to_topic_columns(data, docType):
     be used to avoid double-counting (as 
     many sentences contain more than one
     extraction, but each extraction has 
-    its own row).
+    its own row). The XML can be parsed
+    across several worker processes.
     """
     
     print('Addings scores to topic columns...')
     if docType.lower() == 'batch':
-        for index, row in data.iterrows():
-            xml = row['Sentence(Inc. Annotations)']
-            try:
-                tree = etree.fromstring(xml).xpath("//*[starts-with(local-name(), 'TRUEEVENT')]")
-            except:
+        matches = scoring_utils.find_topic_attributes(data['Sentence(Inc. Annotations)'], data['Extraction'], workers, extractor)
+        for index, attribs in zip(data.index, matches):
+            if attribs is None:
                 print('\r\nERROR in XML for document {}'.format(str(index)))
                 sys.exit(1)
-            for elem in tree:
-                extraction = _stringify_children(elem)
-                extraction = re.sub('<[^>]+>', '', extraction)
-                if extraction == data.loc[index, 'Extraction']:
-                    topics = [key for key, value in elem.attrib.items() if 'prop_topic_' in key]
-                    for topic in set(topics):
-                        topic = re.sub('prop_', '', topic)
-                        data.loc[index, topic] += 1
+            for attrib in attribs:
+                topics = [key for key, value in attrib.items() if 'prop_topic_' in key]
+                for topic in set(topics):
+                    topic = re.sub('prop_', '', topic)
+                    data.loc[index, topic] += 1
     else:
-        for index, row in data.iterrows():
-            props = [key for x in ast.literal_eval(row['properties']) for key in x.keys() if re.search(r'^topic_', key)]
-            for topic in props:
-                data.loc[index, topic] += 1
+        hitRows, hitTopics = scoring_utils.find_api_topics(data['properties'])
+        data = scoring_utils.add_topic_counts(data, hitRows, hitTopics)
     return data
 
 
@@ -174,18 +160,19 @@ def _add_weights_to_scores(data, topics, docType):
             colName = 'Event Type'
         else:
             colName = 'eventName'
-        data[topic] = pd.np.where(data[colName].str.contains(r'(?i)Catch', regex=True), data[topic]*scoreDict['Catch'], data[topic])
-        data[topic] = pd.np.where(data[colName].str.contains(r'(?i)Forecast', regex=True), data[topic]*scoreDict['Forecast'], data[topic])
+        data[topic] = np.where(data[colName].str.contains(r'(?i)Catch', regex=True), data[topic]*scoreDict['Catch'], data[topic])
+        data[topic] = np.where(data[colName].str.contains(r'(?i)Forecast', regex=True), data[topic]*scoreDict['Forecast'], data[topic])
     return data
 
 
-def _aggregate_scores(data, topics, docType):
+def _aggregate_scores(data, topics, docType, mode='sum'):
     
     """
     Aggregates the scores by 
     organization and date (so
     each publication gets its own
-    score).
+    score). Scores are summed by
+    default.
     """
     
     print('Aggregating scores...')
@@ -198,7 +185,7 @@ def _aggregate_scores(data, topics, docType):
     columns = firstCols + sorted(topics, key=str.lower)
     try:
         data = data[columns]
-        data = data.groupby(sortCols, as_index=False).sum()
+        data = scoring_utils.aggregate_topics(data, sortCols, topics, mode)
     except KeyError:
         columns.remove('Ticker')
         sortCols.remove('Ticker')
@@ -276,7 +263,7 @@ def _clean_topic_names(data):
     return data
 
 
-def _write(data, aggCheck, doc):
+def _write(data, aggCheck, doc, formats=('csv',)):
     
     """
     Writes both the normal score file
@@ -284,17 +271,66 @@ def _write(data, aggCheck, doc):
     a tally of each topic contained
     in the extraction in new columns
     on the right) and the aggregated
-    score file.
+    score file, in each of the requested
+    output formats.
     """
     
     print('Writing new documents...')
-    document = doc[:-4] + '_wScoring.csv'
+    base     = os.path.splitext(doc)[0]
+    document = base + '_wScoring.csv'
     if aggCheck:
-        document = doc[:-4] + '_wAggregateScoring.csv'
-    data.to_csv(document, index=False, quoting=csv.QUOTE_ALL)
+        document = base + '_wAggregateScoring.csv'
+    io_utils.write_frame(data, document, formats)
 
 
 
+def _score_results(data, doc, docType, args):
+    
+    """
+    Runs the scoring stages on a results
+    dataframe that is already in memory
+    and writes the score documents next
+    to doc. args holds the aggregation,
+    workers, extractor and format options.
+    """
+    
+    topics   = _init_topics()
+    data     = _score_topics(data, topics, docType, args.workers, args.extractor)
+    _score_from_topics(data, topics, doc, docType, args)
+
+
+def _score_topics(data, topics, docType, workers=1, extractor='lxml'):
+    
+    """
+    Adds the topic columns and fills them
+    from the annotated sentences (the XML
+    parse), before any weights are applied.
+    The stream extractor reads the raw
+    sentences, so they are not reformatted.
+    """
+    
+    data     = _add_topics_columns(data, topics)
+    if docType.lower() == 'batch' and extractor == 'lxml':
+        data = _format_xmls_correctly(data)
+    return _add_scores_to_topic_columns(data, docType, workers, extractor)
+
+
+def _score_from_topics(data, topics, doc, docType, args):
+    
+    """
+    Runs the remaining scoring stages on
+    the output of _score_topics and writes
+    the score documents.
+    """
+    
+    data     = _add_weights_to_scores(data, topics, docType)
+    aggData  = _aggregate_scores(data, topics, docType, args.aggregation)
+    aggData  = _normalize_scores(aggData, topics)
+    data     = _clean_topic_names(data)
+    aggData  = _clean_topic_names(aggData)
+    _write(data, False, doc, formats=args.format)
+    _write(aggData, True, doc, formats=args.format)
+
 ##########################################################################
 ##########################################################################
 ##########################################################################
@@ -305,21 +341,15 @@ if __name__ == '__main__':
     parser   = argparse.ArgumentParser(description='Scores OpenSeSaFi documents to produce their final output.')
     parser.add_argument('document', help='The results document to score (.csv).')
     parser.add_argument('resultsType', help='"Batch" or "API"')
+    parser.add_argument('--aggregation', choices=scoring_utils.AGGREGATIONS, default=DEFAULT_AGGREGATION, help='How topic scores are aggregated per company and date (default sum).')
+    parser.add_argument('--format', nargs='+', choices=io_utils.OUTPUT_FORMATS, default=['csv'], help='Output format(s) for the score documents (default csv).')
+    parser.add_argument('--project', action='store_true', help='Only read the columns used for scoring (the row-level score file then only has those columns).')
+    parser.add_argument('--engine', choices=['c', 'pyarrow'], help='CSV parser to use with --project (pyarrow parses with several threads).')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes used to parse the XML (default 1).')
+    parser.add_argument('--extractor', choices=scoring_utils.EXTRACTORS, default='lxml', help='How the TRUEEVENTs are read from the annotated sentences: lxml parses them after the XML fix-ups, stream tokenizes the raw sentences (default lxml).')
     args     = parser.parse_args()
     doc      = args.document
     docType  = args.resultsType
     
-    data     = _read(doc)
-    topics   = _init_topics()
-    data     = _add_topics_columns(data, topics)
-    if docType.lower() == 'batch':
-        data = _format_xmls_correctly(data)
-    data     = _add_scores_to_topic_columns(data, docType)
-    data     = _add_weights_to_scores(data, topics, docType)
-    aggData  = _aggregate_scores(data, topics, docType)
-    aggData  = _normalize_scores(aggData, topics)
-    data     = _clean_topic_names(data)
-    aggData  = _clean_topic_names(aggData)
-    _write(data, False, doc)
-    _write(aggData, True, doc)
+    _score_results(_read(doc, docType if args.project else None, args.engine), doc, docType, args)
     print('\r\nDONE!')
\ No newline at end of file
@@ -1,8 +1,7 @@
 import pandas as pd
-import re, csv, argparse, sys, ast
-from lxml import etree
-from itertools import chain
+import re, csv, argparse, sys, os, json, sqlite3
 import numpy as np 
+import scoring_utils, io_utils
 """
 
 This document is used to go from the final output stage from the VIP
@@ -16,14 +15,22 @@ Last updated: Annapoorani, 10/18/2019 - text extractions
 """
 
 
-def _read(document):
+SENTENCE_SPLITTER   = re.compile(r'(?<=[^A-Z].[.?]) +(?=[A-Z])')
+DEFAULT_AGGREGATION = 'signed_extremum'
+
+
+def _read(document, profile=None, engine=None):
     
     """
-    Read in the data.
+    Read in the data. If a scoring
+    profile ('batch' or 'api') is given,
+    only the columns it needs are read.
     """
     
     print('Reading data...')
-    return pd.read_csv(document, low_memory=False)
+    if profile:
+        return io_utils.read_projected(document, profile, engine)
+    return io_utils.read_frame(document, low_memory=False)
     
 
 def _init_topics():
@@ -68,13 +75,15 @@ def _add_topics_columns(data, topics):
     Add a column for each
     topic mentioned in the
     results. Each is assigned
-    a score of 0 to begin.
+    a score of 0 to begin. All
+    of the columns are added in
+    a single block rather than
+    one insert per topic.
     """
     
     print('Addings unique topics as column headers...')
-    for topic in topics:
-        data[topic] = 0.
-    return data
+    topicData = pd.DataFrame(np.zeros((len(data), len(topics))), index=data.index, columns=topics)
+    return pd.concat([data, topicData], axis=1)
 
 
 def _format_xmls_correctly(data):
@@ -86,27 +95,55 @@ def _format_xmls_correctly(data):
     """
     
     print('Formatting XML language...')
-    data['Sentence(Inc. Annotations)'] = data['Sentence(Inc. Annotations)'].str.replace(r"(=)([a-z0-9_]+)", r"\1'\2'")
+    data['Sentence(Inc. Annotations)'] = data['Sentence(Inc. Annotations)'].str.replace(r"(=)([a-z0-9_]+)", r"\1'\2'", regex=True)
     data['Sentence(Inc. Annotations)'] = data['Sentence(Inc. Annotations)'].str.replace(r'&', '&amp;')
-    data['Sentence(Inc. Annotations)'] = data['Sentence(Inc. Annotations)'].str.replace(r'<\/?sa\.irrelevant\.rule>', '')
+    data['Sentence(Inc. Annotations)'] = data['Sentence(Inc. Annotations)'].str.replace(r'<\/?sa\.irrelevant\.rule>', '', regex=True)
     return data
     
 
-def _stringify_children(node):
+def _replace_columns(data, columns, values):
+    
+    """
+    Swaps in new values for a block of
+    columns in one piece, keeping the
+    column order, so the frame is not
+    fragmented column by column.
+    """
+    
+    block = pd.DataFrame(values, index=data.index, columns=columns)
+    return pd.concat([data.drop(columns=columns), block], axis=1)[data.columns]
+
+
+def _build_topic_matrix(data, topics, hitRows, hitTopics):
     
     """
     Used in the _add_scores_to_topic_columns
-    function. Turns the extraction XML
-    data into a single string, regardless
-    of whether there are slots (or other
-    tagged data) within the string.
+    function. Fills a preallocated topic
+    matrix from the (row, topic) pairs
+    collected while parsing with one bulk
+    assignment, then writes it back to the
+    topic columns. Topics that are not in
+    the topic list are appended as new
+    columns (blank where not found).
     """
     
-    parts = ([node.text] + list(chain(*([etree.tostring(c, encoding=str, with_tail=False), c.tail] for c in node.getchildren()))))
-    return ''.join(filter(None, parts))
+    topicIdx = {topic: idx for idx, topic in enumerate(topics)}
+    extras   = [topic for topic in dict.fromkeys(hitTopics) if topic not in topicIdx]
+    for topic in extras:
+        topicIdx[topic] = len(topicIdx)
+    matrix = np.zeros((len(data), len(topicIdx)))
+    matrix[:, len(topics):] = np.nan
+    if len(hitRows):
+        cols = np.fromiter((topicIdx[topic] for topic in hitTopics), dtype=np.intp, count=len(hitTopics))
+        matrix[np.asarray(hitRows, dtype=np.intp), cols] = 1
+    data = _replace_columns(data, topics, matrix[:, :len(topics)])
+    if extras:
+        extraData = pd.DataFrame(matrix[:, len(topics):], index=data.index, columns=extras)
+        data = pd.concat([data, extraData], axis=1)
+    return data
 
 
-def _add_scores_to_topic_columns(data, docType):
+def _add_scores_to_topic_columns(data, topics, docType, workers=1, extractor='lxml'):
     
     """
     Matches up the extraction to the correct
@@ -115,99 +152,154 @@ def _add_scores_to_topic_columns(data, docType):
     be used to avoid double-counting (as 
     many sentences contain more than one
     extraction, but each extraction has 
-    its own row).
+    its own row). The (row, topic) hits are
+    collected first and written to the
+    topic columns in one go. The XML can
+    be parsed across several worker
+    processes.
     """
     
     print('Addings scores to topic columns...')
+    hitRows   = []
+    hitTopics = []
     if docType.lower() == 'batch':
-        for index, row in data.iterrows():
-            xml = row['Sentence(Inc. Annotations)']
-            try:
-                tree = etree.fromstring(xml).xpath("//*[starts-with(local-name(), 'TRUEEVENT')]")
-            except:
+        matches = scoring_utils.find_topic_attributes(data['Sentence(Inc. Annotations)'], data['Extraction'], workers, extractor)
+        for rowNum, (index, attribs) in enumerate(zip(data.index, matches)):
+            if attribs is None:
                 print('\r\nERROR in XML for document {}'.format(str(index)))
                 continue
-            for elem in tree:
-                extraction = _stringify_children(elem)
-                extraction = re.sub('<[^>]+>', '', extraction)
-                if extraction == data.loc[index, 'Extraction']:
-                    #topics = [key for key, value in elem.attrib.items() if re.search(r'prop_topic_[^=]*="?sentence', key)]
-                    topics = [key for key, value in elem.attrib.items() if ('prop_topic_' in key and (value == 'sentence' or value == 'paragraph'))]
-                    for topic in set(topics):
-                        topic = re.sub('prop_', '', topic)
-                        data.loc[index, topic] = 1
+            for attrib in attribs:
+                #topics = [key for key, value in elem.attrib.items() if re.search(r'prop_topic_[^=]*="?sentence', key)]
+                elemTopics = [key for key, value in attrib.items() if ('prop_topic_' in key and (value == 'sentence' or value == 'paragraph'))]
+                for topic in set(elemTopics):
+                    hitRows.append(rowNum)
+                    hitTopics.append(re.sub('prop_', '', topic))
     else:
-        for index, row in data.iterrows():
-            props = [key for x in ast.literal_eval(row['properties']) for key in x.keys() if re.search(r'^topic_', key)]
-            for topic in props:
-                data.loc[index, topic] = 1
-    return data
+        hitRows, hitTopics = scoring_utils.find_api_topics(data['properties'])
+    return _build_topic_matrix(data, topics, hitRows, hitTopics)
 
 
-def _add_weights_to_scores(data, topics, docType):
+def _init_weights(document=None):
     
     """
-    Multiples the counts in each
-    topic column by the default weight
-    for normal extractions, then
-    adjusts for if it is a catch rule, 
-    forecast, etc.
+    Defines the weight table. Each event
+    type listed gets its own weight, any
+    other event type is treated as a catch
+    rule, and negated extractions are
+    multiplied by the negation weight. A
+    JSON file of the same shape can be
+    given to add or override entries.
     """
     
-    print('Adding weights to topic scores...')
     scoreDict = {
+            'OS IS Investment Objective': 1,
+            'OS IS short name': 1,
+            'OS IS Principle Strategy': 0.6,
             'Catch': 0.03,
-            #'ELSE': 0.3,
-            'Investment Objective': 1,
-            'Principle Strategy': 0.6,
             'Negation': -1,
             }
-    for topic in topics:
-       # data[topic] = data[topic]*scoreDict['ELSE']
-        if docType.lower() == 'batch':
-            colName = 'Sentence(Inc. Annotations)'
-        else:
-            colName = 'eventName'
-        #data[topic] = pd.np.where(data[colName].str.contains(r'(?i)prop_forecast', regex=True), data[topic]*scoreDict['Forecast'], data[topic])
-        data[topic] = pd.np.where(data['Event Type'] == 'OS IS Investment Objective', data[topic]*scoreDict['Investment Objective'], data[topic])
-        data[topic] = pd.np.where(data['Event Type'] == 'OS IS short name', data[topic]*scoreDict['Investment Objective'], data[topic])
-        data[topic] = pd.np.where(data['Event Type'] == 'OS IS Principle Strategy', data[topic]*scoreDict['Principle Strategy'], data[topic])
-        data[topic] = pd.np.where(~data['Event Type'].isin(['OS IS Investment Objective','OS IS Principle Strategy', 'OS IS short name']), data[topic]*scoreDict['Catch'], data[topic])
-        #data[topic] = pd.np.where(data['Event Type'] == 'OS Event Negation',-1*data[topic], data[topic])
-        #data[topic] = pd.np.where(data['Event Type'].str.contains(r'(?i) Catch', regex=True), data[topic]*scoreDict['Catch'], data[topic])
-        #
-        #data[topic] = pd.np.where(data[colName].str.contains(r'(?i)prop_principlestrat', regex=True), data[topic]*scoreDict['Principle Strategy'], data[topic])
-        data[topic] = pd.np.where((data[colName].str.contains(r'(?i)prop_negation_event', regex=True)), np.multiply(data[topic],-1), data[topic])
+    if document:
+        print('Reading weights...')
+        with open(document, 'r') as file:
+            scoreDict.update(json.load(file))
+    return scoreDict
+
+
+def _negated(data, docType):
+    
+    """
+    Flags the rows whose extraction is
+    a negation event.
+    """
+    
+    if docType.lower() == 'batch':
+        colName = 'Sentence(Inc. Annotations)'
+    else:
+        colName = 'eventName'
+    return data[colName].str.contains(r'(?i)prop_negation_event', regex=True, na=False).to_numpy(dtype=bool)
+
+
+def _row_weights(eventCodes, eventTypes, negated, scoreDict):
+    
+    """
+    Turns the weight table into one
+    weight per row from the factorized
+    event types (code -1 for a missing
+    event type gets the catch weight).
+    """
+    
+    eventWeights = {et: weight for et, weight in scoreDict.items() if et not in ['Catch', 'Negation']}
+    typeWeights  = pd.Series(eventTypes, dtype=object).map(eventWeights).astype(float).fillna(scoreDict['Catch']).to_numpy()
+    weights      = np.append(typeWeights, float(scoreDict['Catch']))[eventCodes]
+    return np.where(negated, weights*scoreDict['Negation'], weights)
+
+
+def _compute_row_weights(data, scoreDict, docType):
+    
+    """
+    Turns the weight table into one
+    weight per row: the event type
+    weight (or the catch weight), times
+    the negation weight where the
+    extraction is a negation event.
+    """
+    
+    eventCodes, eventTypes = pd.factorize(data['Event Type'])
+    return _row_weights(eventCodes, eventTypes, _negated(data, docType), scoreDict)
+
+
+def _add_weights_to_scores(data, topics, docType, scoreDict=None):
+    
+    """
+    Multiples the counts in each
+    topic column by the weight for
+    its event type (catch rule,
+    investment objective, etc.) and
+    flips the sign of negations. The
+    weights are computed once per row
+    and applied to the whole topic
+    matrix at once.
+    """
+    
+    print('Adding weights to topic scores...')
+    if scoreDict is None:
+        scoreDict = _init_weights()
+    weights = _compute_row_weights(data, scoreDict, docType)
+    data = _replace_columns(data, topics, data[topics].to_numpy(dtype=float) * weights[:, np.newaxis])
     return data
 
 
 
-def _aggregate_scores(data, topics, docType):
+def _key_columns(docType):
+    
+    """
+    Returns the columns kept in the
+    aggregate scores and the columns
+    they are grouped by.
+    """
+    
+    if docType.lower() == 'batch':
+        return ['Main Company', 'Article Date'], ['Main Company', 'Article Date']
+    return ['companyName', 'ticker', 'eventDate'], ['ticker', 'eventDate']
+
+
+def _aggregate_scores(data, topics, docType, mode='signed_extremum'):
     
     """
     Aggregates the scores by 
     organization and date (so
     each publication gets its own
-    score).
+    score). By default each topic keeps
+    the signed score with the largest
+    magnitude.
     """
     
     print('Aggregating scores...')
-    if docType.lower() == 'batch':
-        firstCols = ['Main Company', 'Article Date']
-        sortCols  = ['Main Company', 'Article Date']
-    else:
-        firstCols = ['companyName', 'ticker', 'eventDate']
-        sortCols  = ['ticker', 'eventDate']
+    firstCols, sortCols = _key_columns(docType)
     columns = firstCols + sorted(topics, key=str.lower)
     try:
         data = data[columns]
-        data_pos = data.groupby(sortCols, as_index=False).max()
-        data_neg = data.groupby(sortCols, as_index=False).min()
-        for i in range(len(data_pos)):
-            for names in topics:
-                if abs(data_neg[names].iloc[i])>data_pos[names].iloc[i]:
-                    data_pos[names].iloc[i] = data_neg[names].iloc[i]
-        data = data_pos
+        data = scoring_utils.aggregate_topics(data, sortCols, topics, mode)
     except KeyError:
         columns.remove('Ticker')
         sortCols.remove('Ticker')
@@ -303,7 +395,7 @@ def _clean_topic_names(data):
     return data
 
 
-def _write(data, aggCheck, doc, add_text=False):
+def _write(data, aggCheck, doc, add_text=False, formats=('csv',)):
     
     """
     Writes both the normal score file
@@ -311,67 +403,408 @@ def _write(data, aggCheck, doc, add_text=False):
     a tally of each topic contained
     in the extraction in new columns
     on the right) and the aggregated
-    score file.
+    score file, in each of the requested
+    output formats.
     """
     
     print('Writing new documents...')
-    document = doc[:-4] + '_wScoring.csv'
+    base     = os.path.splitext(doc)[0]
+    document = base + '_wScoring.csv'
     if aggCheck:
-        document = doc[:-4] + '_wAggregateScoring.csv'
+        document = base + '_wAggregateScoring.csv'
     if add_text:
-        document = doc[:-4] + '_wText_Extraction.csv'
-    data.to_csv(document, index=False, quoting=csv.QUOTE_ALL)
-
-def _add_text_extraction(aggData,data):
-    """
-    write to add text extraction 
-    for themes which has theme score
-    created: Zhen Lu 1/9/2019
-    UPDATED: Annapoorani L 10/18/2019
-    Picks the only sentence with the extraction and creates an entity which can be highlighted on the UI. 
-    """
-    print ("Adding text extraction...")
-    data.replace(to_replace = "[P|p]rincipal [I|i]nvestment [S|s]trateg[y|ies](:?)( *)", value = "",regex = True, inplace = True)
-    data.replace(to_replace = "[I|i]nvestment [O|o]bjective(s*)(:*)( *)", value = "",regex = True, inplace = True)
-    data.replace(to_replace = "PRINCIPAL INVESTMENT STRATEG[Y|IES](:?)( *)", value = "",regex = True, inplace = True)
-    data.replace(to_replace = "INVESTMENT OBJECTIVE(S*)(:*)( *)", value = "",regex = True, inplace = True)
-    data.replace(to_replace = "short_desc ", value = "",regex = True, inplace = True)
-    data.replace(to_replace = "short_name ", value = "",regex = True, inplace = True)
+        document = base + '_wText_Extraction.csv'
+    io_utils.write_frame(data, document, formats)
+
+
+def _clean_extraction_text(data):
+    
+    """
+    Strips the section headings and
+    the short_name / short_desc markers
+    from the text columns before they
+    are used as text extractions.
+    Categorical columns are turned back
+    into plain text first.
+    """
+    
+    categories = [column for column in data.columns if isinstance(data[column].dtype, pd.CategoricalDtype)]
+    data = data.astype({column: object for column in categories})
+    data = data.replace(to_replace = "[P|p]rincipal [I|i]nvestment [S|s]trateg[y|ies](:?)( *)", value = "",regex = True)
+    data = data.replace(to_replace = "[I|i]nvestment [O|o]bjective(s*)(:*)( *)", value = "",regex = True)
+    data = data.replace(to_replace = "PRINCIPAL INVESTMENT STRATEG[Y|IES](:?)( *)", value = "",regex = True)
+    data = data.replace(to_replace = "INVESTMENT OBJECTIVE(S*)(:*)( *)", value = "",regex = True)
+    data = data.replace(to_replace = "short_desc ", value = "",regex = True)
+    data = data.replace(to_replace = "short_name ", value = "",regex = True)
+    return data
+
+
+def _pick_sentence(sentence, entity):
+    
+    """
+    Picks the only sentence with the
+    extraction out of the full
+    Sentence text, falling back to the
+    full text if none contains it.
+    """
+    
+    if not isinstance(sentence, str) or not isinstance(entity, str):
+        return sentence
+    lst = [part for part in SENTENCE_SPLITTER.split(sentence) if entity in part]
+    if len(lst) > 0:
+        return lst[0].strip()
+    return sentence
+
+
+def _select_evidence(data, theme_columns):
+    
+    """
+    Finds, in one grouped pass, the
+    highest scoring extraction row per
+    company and theme (for positive
+    scores) and the lowest scoring one
+    (for negative scores). Only those
+    winning rows have their sentence
+    split. Returns a long table of
+    Main Company, Theme, Direction,
+    Score and Text.
+    """
+    
+    grouped  = data.groupby('Main Company', sort=False)[theme_columns]
+    evidence = []
+    for direction, scores, rows in [('positive', grouped.max(), grouped.idxmax()),
+                                    ('negative', grouped.min(), grouped.idxmin())]:
+        found = pd.DataFrame({'Main Company': np.repeat(scores.index.to_numpy(), len(theme_columns)),
+                              'Theme': np.tile(theme_columns, len(scores)),
+                              'Direction': direction,
+                              'Score': scores.to_numpy(dtype=float).ravel(),
+                              'Row': rows.to_numpy().ravel()})
+        if direction == 'positive':
+            evidence.append(found[found['Score'] > 0])
+        else:
+            evidence.append(found[found['Score'] < 0])
+    evidence = pd.concat(evidence, ignore_index=True)
+    winners  = data.loc[evidence['Row'].unique(), ['Sentence', 'Extraction']]
+    texts    = {row: _pick_sentence(sentence, entity) for row, sentence, entity in zip(winners.index, winners['Sentence'], winners['Extraction'])}
+    evidence['Text'] = evidence['Row'].map(texts)
+    return evidence.drop(columns=['Row'])
+
+
+def _fill_text_columns(aggData, evidence):
+    
+    """
+    Adds a _text column for each theme,
+    holding the positive evidence where
+    the company's theme score is above 0
+    and the negative evidence where it
+    is below 0.
+    """
+    
     aggData.drop_duplicates(subset=['Main Company'], keep='first', inplace=True)
     aggData2 = aggData.set_index('Main Company',drop=False)
     theme_columns = list(aggData.columns[2:])
     text_columns = [column+'_text' for column in theme_columns]
-    for column in text_columns:
-        aggData2[column] = ''
-    for ticker in aggData['Main Company']:
-        for column in theme_columns:
-            if aggData2.at[ticker,column] > 0:
-                text_column = column+'_text'
-                df = data[data['Main Company']==ticker].sort_values(by=[column],ascending=False)
-                entity= df.iloc[0]['Extraction']
-                lst = [sentence for sentence in re.split(r'(?<=[^A-Z].[.?]) +(?=[A-Z])', df.iloc[0]['Sentence']) if entity in sentence]
-                if len(lst) > 0:
-                    text = lst[0].strip()
-                else:
-                    text = df.iloc[0]['Sentence']
-    #                aggData2.at[ticker,text_column] = "##text##"+text+"##entity##"+entity
-                aggData2.at[ticker,text_column] = text
-            if aggData2.at[ticker,column] < 0:
-                text_column = column+'_text'
-                df = data[data['Main Company']==ticker].sort_values(by=[column],ascending=True)
-                entity= df.iloc[0]['Extraction']
-                lst = [sentence for sentence in re.split(r'(?<=[^A-Z].[.?]) +(?=[A-Z])', df.iloc[0]['Sentence']) if entity in sentence]
-                if len(lst) > 0:
-                    text = lst[0].strip()
-                else:
-                    text = df.iloc[0]['Sentence']
-    #                aggData2.at[ticker,text_column] = "##text##"+text+"##entity##"+entity
-                aggData2.at[ticker,text_column] = text
-#    theme_columns = theme_columns.append('Main Company')
-#    text_columns = text_columns.append('Main Company')
-#    aggScore = aggData2[theme_columns]
-#    aggText = aggData2[text_columns]
-    return aggData2
+    scores = aggData2[theme_columns].to_numpy(dtype=float)
+    texts  = {}
+    for direction in ['positive', 'negative']:
+        found = evidence[evidence['Direction'] == direction]
+        texts[direction] = (found.pivot(index='Main Company', columns='Theme', values='Text')
+                                 .reindex(index=aggData2.index, columns=theme_columns)
+                                 .fillna('').to_numpy(dtype=object))
+    text = np.where(scores > 0, texts['positive'], np.where(scores < 0, texts['negative'], ''))
+    textData = pd.DataFrame(text, index=aggData2.index, columns=text_columns)
+    return pd.concat([aggData2, textData], axis=1)
+
+
+def _combine_groups(running, chunk, how):
+    
+    """
+    Used in the _score_in_chunks function.
+    Folds the per-(company, date) scores
+    of a new chunk into the running ones.
+    """
+    
+    if running is None:
+        return chunk
+    return pd.concat([running, chunk]).groupby(level=list(range(chunk.index.nlevels))).agg(how)
+
+
+def _merge_evidence(running, evidence):
+    
+    """
+    Used in the _score_in_chunks function.
+    Keeps the best evidence row per
+    company, theme and direction, with
+    earlier rows winning ties (as in a
+    single pass over the whole file).
+    """
+    
+    if running is None:
+        return evidence
+    both = pd.concat([running, evidence], ignore_index=True)
+    rank = np.where(both['Direction'] == 'positive', -both['Score'], both['Score'])
+    both = both.iloc[np.argsort(rank, kind='stable')]
+    return both.drop_duplicates(subset=['Main Company', 'Theme', 'Direction'], keep='first')
+
+
+def _score_in_chunks(doc, docType, topics, scoreDict, mode, workers, chunksize, project=False, extractor='lxml'):
+    
+    """
+    Streaming version of the scoring run
+    for corpora that do not fit in memory.
+    Reads and scores the results in chunks,
+    appending each chunk to the row-level
+    score file, and keeps only the running
+    per-(company, date) aggregates and the
+    best evidence per (company, theme).
+    Topics only found after the first chunk
+    are not added to the row-level file,
+    which is always written as CSV. The
+    results may be a CSV, Parquet or
+    Feather document. With project, only
+    the scoring columns are read.
+    """
+    
+    document  = os.path.splitext(doc)[0] + '_wScoring.csv'
+    groupCols = ['Main Company', 'Article Date']
+    topicCols = sorted(topics, key=str.lower)
+    how       = 'sum' if mode == 'sum' else 'max'
+    maxima    = None
+    minima    = None
+    evidence  = None
+    columns   = None
+    for chunkNum, data in enumerate(io_utils.read_chunks(doc, chunksize, docType if project else None)):
+        print('\r\nScoring chunk {}...'.format(str(chunkNum + 1)))
+        data   = _add_topics_columns(data, topics)
+        if extractor == 'lxml':
+            data = _format_xmls_correctly(data)
+        data   = _add_scores_to_topic_columns(data, topics, docType, workers, extractor)
+        data   = _add_weights_to_scores(data, topics, docType, scoreDict)
+        stats  = data[groupCols + topicCols].groupby(groupCols)
+        maxima = _combine_groups(maxima, stats.agg(how), how)
+        if mode == 'signed_extremum':
+            minima = _combine_groups(minima, stats.min(), 'min')
+        data   = _clean_topic_names(data)
+        data   = _clean_extraction_text(data)
+        themes = [re.sub(r'^topic_(.*)$', r'\1', topic) for topic in topicCols]
+        evidence = _merge_evidence(evidence, _select_evidence(data, themes))
+        if columns is None:
+            columns = list(data.columns)
+            data.to_csv(document, index=False, quoting=csv.QUOTE_ALL)
+        else:
+            data.reindex(columns=columns).to_csv(document, index=False, quoting=csv.QUOTE_ALL, mode='a', header=False)
+    aggData = maxima
+    if mode == 'signed_extremum':
+        posValues = maxima.to_numpy(dtype=float)
+        negValues = minima.to_numpy(dtype=float)
+        aggData   = pd.DataFrame(np.where(np.abs(negValues) > posValues, negValues, posValues), index=maxima.index, columns=topicCols)
+    aggData = _clean_topic_names(aggData.reset_index())
+    return aggData, evidence
+
+
+def _update_store(store, aggData, evidence):
+    
+    """
+    Incremental rescoring. Replaces the
+    aggregate scores and evidence rows of
+    every company in the new results in
+    the persisted (SQLite) store, and
+    returns the full contents of the store
+    so the final documents cover the whole
+    corpus.
+    """
+    
+    print('Updating aggregate store...')
+    companies = set(aggData['Main Company'])
+    with sqlite3.connect(store) as conn:
+        tables = set(pd.read_sql("SELECT name FROM sqlite_master WHERE type='table'", conn)['name'])
+        if 'scores' in tables and 'evidence' in tables:
+            oldScores   = pd.read_sql('SELECT * FROM scores', conn)
+            oldEvidence = pd.read_sql('SELECT * FROM evidence', conn)
+            aggData  = pd.concat([oldScores[~oldScores['Main Company'].isin(companies)], aggData], ignore_index=True)
+            evidence = pd.concat([oldEvidence[~oldEvidence['Main Company'].isin(companies)], evidence], ignore_index=True)
+        aggData = aggData.sort_values(by=['Main Company', 'Article Date'], kind='stable').reset_index(drop=True)
+        aggData.to_sql('scores', conn, if_exists='replace', index=False)
+        evidence.to_sql('evidence', conn, if_exists='replace', index=False)
+    return aggData, evidence
+
+
+def _write_snapshot(document, data, topics, docType):
+    
+    """
+    Saves the unweighted topic hits as a
+    sparse (row, topic) snapshot, along
+    with what the weights and the
+    aggregation need: the factorized
+    event types, the negation flags and
+    the factorized key columns of each
+    row. Used by the what-if mode.
+    """
+    
+    print('Writing hit matrix snapshot...')
+    firstCols, sortCols = _key_columns(docType)
+    hits = data[topics].to_numpy(dtype=float)
+    hitRows, hitCols = np.nonzero(hits)
+    eventCodes, eventTypes = pd.factorize(data['Event Type'])
+    arrays = {
+            'docType': np.array(docType), 'topics': np.array(topics), 'keyNames': np.array(firstCols),
+            'hitRows': hitRows.astype(np.int32), 'hitCols': hitCols.astype(np.int32), 'hitValues': hits[hitRows, hitCols],
+            'eventCodes': eventCodes.astype(np.int32), 'eventTypes': np.asarray(eventTypes, dtype=str),
+            'negated': _negated(data, docType),
+            }
+    for idx, column in enumerate(firstCols):
+        keyCodes, keyValues = pd.factorize(data[column])
+        arrays['keyCodes{}'.format(idx)]  = keyCodes.astype(np.int32)
+        arrays['keyValues{}'.format(idx)] = np.asarray(keyValues, dtype=str)
+    np.savez_compressed(document, **arrays)
+
+
+def _what_if_scores(snapshot, scoreDict, mode='signed_extremum'):
+    
+    """
+    Weights and aggregates the hits of a
+    snapshot without rebuilding the dense
+    topic matrix. Only the hits are
+    visited; a (group, topic) cell with
+    fewer hits than rows in its group
+    also holds the implicit zeros of the
+    other rows, which count towards its
+    max and min. Returns the same frame
+    as _aggregate_scores.
+    """
+    
+    docType = str(snapshot['docType'])
+    topics  = list(snapshot['topics'])
+    firstCols, sortCols = _key_columns(docType)
+    keys = pd.DataFrame({column: pd.Categorical.from_codes(snapshot['keyCodes{}'.format(idx)], snapshot['keyValues{}'.format(idx)]).astype(object)
+                         for idx, column in enumerate(firstCols)})
+    groups    = keys.groupby(sortCols, sort=True).ngroup().to_numpy()
+    groupData = keys[groups >= 0].groupby(sortCols, as_index=False).max()
+    numCells  = len(groupData) * len(topics)
+    weights   = _row_weights(snapshot['eventCodes'], snapshot['eventTypes'], snapshot['negated'], scoreDict)
+    hitGroups = groups[snapshot['hitRows']]
+    found     = hitGroups >= 0
+    cells     = hitGroups[found] * len(topics) + snapshot['hitCols'][found]
+    values    = (snapshot['hitValues'] * weights[snapshot['hitRows']])[found]
+    if mode == 'sum':
+        scores = np.bincount(cells, weights=values, minlength=numCells)
+    else:
+        sizes  = np.bincount(groups[groups >= 0], minlength=len(groupData))
+        zeros  = np.bincount(cells, minlength=numCells) < np.repeat(sizes, len(topics))
+        pos    = np.full(numCells, -np.inf)
+        neg    = np.full(numCells, np.inf)
+        np.maximum.at(pos, cells, values)
+        np.minimum.at(neg, cells, values)
+        pos    = np.where(zeros, np.maximum(pos, 0), pos)
+        neg    = np.where(zeros, np.minimum(neg, 0), neg)
+        scores = pos if mode == 'max' else np.where(np.abs(neg) > pos, neg, pos)
+    scores = pd.DataFrame(scores.reshape(len(groupData), len(topics)), columns=topics)
+    return pd.concat([groupData, scores[sorted(topics, key=str.lower)]], axis=1)
+
+
+def _run_what_if(document, scenarios, defaultMode, formats=('csv',)):
+    
+    """
+    Evaluates each weight scenario on a
+    snapshot and writes its aggregate
+    scores. A scenario is a weights JSON
+    file (or 'default'), optionally
+    followed by :<aggregation>.
+    """
+    
+    runs = []
+    for scenario in scenarios:
+        weights, sep, mode = scenario.rpartition(':')
+        if not sep or mode not in scoring_utils.AGGREGATIONS:
+            weights, mode = scenario, defaultMode
+        name = os.path.splitext(os.path.basename(weights))[0]
+        runs.append((weights, mode, '{}_{}_{}.csv'.format(os.path.splitext(document)[0], name, mode)))    # .csv so _write keeps any dots in the name
+    outputs = [output for weights, mode, output in runs]
+    if len(set(outputs)) < len(outputs):
+        print('\r\nERROR: Several scenarios would be written to the same file; '
+              'give each weights file its own name.')
+        sys.exit(1)
+    print('Reading hit matrix snapshot...')
+    with np.load(document, allow_pickle=False) as file:
+        snapshot = dict(file)
+    for weights, mode, output in runs:
+        print('Scenario {} ({})...'.format(weights, mode))
+        scoreDict = _init_weights(None if weights == 'default' else weights)
+        aggData   = _clean_topic_names(_what_if_scores(snapshot, scoreDict, mode))
+        if 'Main Company' in aggData.columns:
+            aggData = aggData.drop_duplicates(subset=['Main Company'], keep='first')    # as in the aggregate documents of a full run
+        _write(aggData, True, output, formats=formats)
+
+
+def _score_results(data, doc, docType, args):
+    
+    """
+    Runs the scoring stages on a results
+    dataframe that is already in memory
+    and writes the score documents next
+    to doc. args holds the aggregation,
+    weights, workers, extractor,
+    incremental and format options.
+    """
+    
+    topics   = _init_topics()
+    data     = _score_topics(data, topics, docType, args.workers, args.extractor)
+    if args.snapshot:
+        _write_snapshot(args.snapshot, data, topics, docType)
+    _score_from_topics(data, topics, doc, docType, args)
+
+
+def _score_topics(data, topics, docType, workers=1, extractor='lxml'):
+    
+    """
+    Adds the topic columns and fills them
+    from the annotated sentences (the XML
+    parse), before any weights are applied.
+    The stream extractor reads the raw
+    sentences, so they are not reformatted.
+    """
+    
+    data     = _add_topics_columns(data, topics)
+    if docType.lower() == 'batch' and extractor == 'lxml':
+        data = _format_xmls_correctly(data)
+    return _add_scores_to_topic_columns(data, topics, docType, workers, extractor)
+
+
+def _score_from_topics(data, topics, doc, docType, args):
+    
+    """
+    Runs the remaining scoring stages on
+    the output of _score_topics and writes
+    the score documents.
+    """
+    
+    data     = _add_weights_to_scores(data, topics, docType, _init_weights(args.weights))
+    aggData  = _aggregate_scores(data, topics, docType, args.aggregation)
+    #aggData  = _normalize_scores(aggData, topics)
+    data     = _clean_topic_names(data)
+    aggData  = _clean_topic_names(aggData)
+    data     = _clean_extraction_text(data)
+    evidence = _select_evidence(data, list(aggData.columns[2:]))
+    _write(data, False, doc, formats=args.format)
+    _write_aggregates(aggData, evidence, doc, args)
+
+
+def _write_aggregates(aggData, evidence, doc, args):
+    
+    """
+    Writes the aggregate score documents,
+    with and without the text extraction
+    (from the whole store in incremental
+    mode).
+    """
+    
+    if args.incremental:
+        aggData, evidence = _update_store(args.incremental, aggData, evidence)
+    print('Adding text extraction...')
+    aggData_with_text = _fill_text_columns(aggData, evidence)
+    _write(aggData, True, doc, formats=args.format)
+#    _write(aggData_with_scores, True, doc, True)
+    _write(aggData_with_text, True, doc, True, formats=args.format)
 
 ##########################################################################
 ##########################################################################
@@ -383,26 +816,34 @@ if __name__ == '__main__':
     parser   = argparse.ArgumentParser(description='Scores OpenSeSaFi documents to produce their final output.')
     parser.add_argument('document', help='The results document to score (.csv).')
     parser.add_argument('resultsType', help='"Batch" or "API"')
+    parser.add_argument('--aggregation', choices=scoring_utils.AGGREGATIONS, default=DEFAULT_AGGREGATION, help='How topic scores are aggregated per company and date (default signed_extremum).')
+    parser.add_argument('--weights', help='JSON file of event type weights to add to or override the defaults.')
+    parser.add_argument('--format', nargs='+', choices=io_utils.OUTPUT_FORMATS, default=['csv'], help='Output format(s) for the score documents (default csv).')
+    parser.add_argument('--project', action='store_true', help='Only read the columns used for scoring (the row-level score file then only has those columns).')
+    parser.add_argument('--engine', choices=['c', 'pyarrow'], help='CSV parser to use with --project (pyarrow parses with several threads).')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes used to parse the XML (default 1).')
+    parser.add_argument('--extractor', choices=scoring_utils.EXTRACTORS, default='lxml', help='How the TRUEEVENTs are read from the annotated sentences: lxml parses them after the XML fix-ups, stream tokenizes the raw sentences (default lxml).')
+    parser.add_argument('--incremental', metavar='STORE', help='SQLite aggregate store to update with the companies in this results file; the aggregate documents are then written from the whole store.')
+    parser.add_argument('--chunksize', type=int, help='Score the results in chunks of this many rows to bound memory use (streaming mode).')
+    parser.add_argument('--snapshot', metavar='NPZ', help='Also save the unweighted topic hits to this snapshot file, for --whatif.')
+    parser.add_argument('--whatif', nargs='+', metavar='SCENARIO', help='Treat the document as a snapshot and write the aggregate scores for each scenario: a weights JSON file (or "default"), optionally followed by :<aggregation>.')
     args     = parser.parse_args()
     doc      = args.document
     docType  = args.resultsType
     
-    data     = _read(doc)
-    topics   = _init_topics()
-    data     = _add_topics_columns(data, topics)
-    if docType.lower() == 'batch':
-        data = _format_xmls_correctly(data)
-    data     = _add_scores_to_topic_columns(data, docType)
-    data     = _add_weights_to_scores(data, topics, docType)
-    aggData  = _aggregate_scores(data, topics, docType)
-    #aggData  = _normalize_scores(aggData, topics)
-    data     = _clean_topic_names(data)
-    aggData  = _clean_topic_names(aggData)
-    aggData_with_text = _add_text_extraction(aggData, data)
-    _write(data, False, doc)
-    _write(aggData, True, doc)
-#    _write(aggData_with_scores, True, doc, True)
-    _write(aggData_with_text, True, doc, True)
+    if args.whatif:
+        _run_what_if(doc, args.whatif, args.aggregation, args.format)
+    elif args.chunksize:
+        if args.snapshot:
+            print('\r\nERROR: Snapshots are not written in streaming mode.')
+            sys.exit(1)
+        if docType.lower() != 'batch':
+            print('\r\nERROR: Streaming mode only supports "Batch" results.')
+            sys.exit(1)
+        aggData, evidence = _score_in_chunks(doc, docType, _init_topics(), _init_weights(args.weights), args.aggregation, args.workers, args.chunksize, args.project, args.extractor)
+        _write_aggregates(aggData, evidence, doc, args)
+    else:
+        _score_results(_read(doc, docType if args.project else None, args.engine), doc, docType, args)
     print('\r\nDONE!')
     
 #docType = 'batch'    
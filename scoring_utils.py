@@ -0,0 +1,292 @@
+import re, ast, json
+import numpy as np
+import pandas as pd
+from lxml import etree
+from itertools import chain, repeat
+from concurrent.futures import ProcessPoolExecutor
+
+"""
+
+Helpers shared by the OpenSesafi scoring scripts (score_STP.py,
+scoreOSFIdata.py and scoreOSFIdata_with_text_extraction.py) for
+pulling the topic attributes out of the annotated sentences.
+
+"""
+
+
+TRUEEVENT_XPATH = "//*[starts-with(local-name(), 'TRUEEVENT')]"
+AGGREGATIONS    = ['sum', 'max', 'signed_extremum']
+EXTRACTORS      = ['lxml', 'stream']
+TOKEN_REGEX     = re.compile(r'<(?:(!--.*?--|\?.*?\?|![^>]*)|(/?)([^\s/>!?]+)((?:[^>"\']|"[^"]*"|\'[^\']*\')*?)(/?))>', re.S)
+ATTRIB_REGEX    = re.compile(r'([^\s=/]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'/>]+))')
+IGNORED_TAGS    = {'sa.irrelevant.rule'}
+ESCAPES         = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+
+
+def _stringify_children(node):
+
+    """
+    Turns the extraction XML
+    data into a single string, regardless
+    of whether there are slots (or other
+    tagged data) within the string.
+    """
+
+    parts = ([node.text] + list(chain(*([etree.tostring(c, encoding=str, with_tail=False), c.tail] for c in node.getchildren()))))
+    return ''.join(filter(None, parts))
+
+
+def extraction_text(elem):
+
+    """
+    Returns the extraction text of an
+    event element, i.e. its contents
+    with the tags stripped out, in the
+    form the Extraction column holds it.
+    """
+
+    return re.sub('<[^>]+>', '', _stringify_children(elem))
+
+
+def _parse_sentence(xml):
+
+    """
+    Parses one annotated sentence and
+    maps the tag-stripped text of each
+    TRUEEVENT in it to the list of topic
+    attributes of the TRUEEVENTs with
+    that text. Returns None if the XML
+    cannot be parsed.
+    """
+
+    try:
+        tree = etree.fromstring(xml).xpath(TRUEEVENT_XPATH)
+    except:
+        return None
+    extractions = {}
+    for elem in tree:
+        extraction = extraction_text(elem)
+        attrib     = {key: value for key, value in elem.attrib.items() if 'prop_topic_' in key}
+        extractions.setdefault(extraction, []).append(attrib)
+    return extractions
+
+
+def _stream_sentence(xml):
+
+    """
+    Streaming alternative to _parse_sentence
+    that returns the same mapping without
+    building a tree. The tags are tokenized
+    in one regex pass over the raw sentence,
+    which may hold unquoted attribute values
+    and bare ampersands (so the sentence does
+    not need the lxml fix-ups). The text of a
+    TRUEEVENT is gathered as the tags go by:
+    its own text as is, and the text of its
+    child elements escaped, as etree.tostring
+    writes it in extraction_text. The
+    sa.irrelevant.rule tags are skipped, as
+    the fix-ups strip them. Returns None
+    if the tags are not well nested under a
+    single root element.
+    """
+
+    if not isinstance(xml, str):
+        return None
+    xml    = xml.replace('\r\n', '\n').replace('\r', '\n')
+    stack  = []
+    events = []
+    active  = []
+    pos    = 0
+    roots  = 0
+    for token in TOKEN_REGEX.finditer(xml):
+        text = xml[pos:token.start()]
+        pos  = token.end()
+        if text:
+            if not stack and text.strip():
+                return None
+            for depth, parts in active:
+                parts.append(text if len(stack) == depth else text.translate(ESCAPES))
+        if token.group(1) is not None:
+            continue
+        name = token.group(3)
+        if name in IGNORED_TAGS:
+            continue
+        if token.group(2):
+            if not stack or stack[-1] != name:
+                return None
+            if active and active[-1][0] == len(stack):
+                active.pop()
+            stack.pop()
+            continue
+        if not stack:
+            roots += 1
+            if roots > 1:
+                return None
+        stack.append(name)
+        if name.rpartition(':')[2].startswith('TRUEEVENT'):
+            attrib = {}
+            for key, double, single, bare in ATTRIB_REGEX.findall(token.group(4)):
+                if 'prop_topic_' in key:
+                    attrib[key] = double or single or bare
+            events.append((attrib, []))
+            active.append((len(stack), events[-1][1]))
+        if token.group(5):
+            if active and active[-1][0] == len(stack):
+                active.pop()
+            stack.pop()
+    if stack or not roots or xml[pos:].strip():
+        return None
+    extractions = {}
+    for attrib, parts in events:
+        extractions.setdefault(''.join(parts), []).append(attrib)
+    return extractions
+
+
+PARSERS = {'lxml': _parse_sentence, 'stream': _stream_sentence}
+
+
+def _parse_sentences(xmls, extractor='lxml'):
+
+    """
+    Parses a chunk of annotated
+    sentences in a worker process.
+    """
+
+    parse = PARSERS[extractor]
+    return [parse(xml) for xml in xmls]
+
+
+def _parse_in_pool(xmls, workers, extractor='lxml'):
+
+    """
+    Splits the unique sentences into
+    chunks and parses them across a pool
+    of worker processes. Returns the
+    sentence -> parsed TRUEEVENTs cache,
+    in the same order as a serial run.
+    """
+
+    unique    = list(dict.fromkeys(xmls))
+    chunkSize = max(1, -(-len(unique) // (workers * 4)))
+    chunks    = [unique[i:i + chunkSize] for i in range(0, len(unique), chunkSize)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parsed = list(chain.from_iterable(pool.map(_parse_sentences, chunks, repeat(extractor))))
+    return dict(zip(unique, parsed))
+
+
+def find_topic_attributes(xmls, extractions, workers=1, extractor='lxml'):
+
+    """
+    Matches each extraction to the
+    TRUEEVENTs in its annotated sentence.
+    Returns, for every row, the list of
+    topic attribute dicts of the matching
+    TRUEEVENTs (None where the XML is bad).
+    Each unique sentence is parsed only
+    once, as the same sentence is repeated
+    for every extraction it contains. With
+    more than one worker the sentences are
+    parsed in a process pool first. The
+    extractor is one of EXTRACTORS: 'lxml'
+    parses each sentence into a tree (the
+    sentences must have been through the
+    scripts' XML fix-ups), 'stream' reads
+    the raw sentences with _stream_sentence.
+    """
+
+    xmls    = list(xmls)
+    parse   = PARSERS[extractor]
+    cache   = _parse_in_pool(xmls, workers, extractor) if workers > 1 else {}
+    matches = []
+    for xml, extraction in zip(xmls, extractions):
+        try:
+            parsed = cache[xml]
+        except KeyError:
+            parsed = cache[xml] = parse(xml)
+        if parsed is None:
+            matches.append(None)
+        else:
+            matches.append(parsed.get(extraction, []))
+    return matches
+
+
+def _topic_keys(payload):
+
+    """
+    Returns the topic_ keys of one API
+    properties payload (a list of dicts),
+    parsed as JSON where possible and as a
+    Python literal otherwise.
+    """
+
+    if not isinstance(payload, str):
+        return []
+    try:
+        props = json.loads(payload)
+    except ValueError:
+        props = ast.literal_eval(payload)
+    return [key for x in props for key in x.keys() if isinstance(key, str) and key.startswith('topic_')]
+
+
+def find_api_topics(properties):
+
+    """
+    Returns the (row position, topic) hit
+    pairs of an API properties column.
+    Each distinct payload is parsed only
+    once, and the topic keys are exploded
+    into one pair per key.
+    """
+
+    codes, payloads = pd.factorize(properties)
+    keys  = [_topic_keys(payload) for payload in payloads]
+    pairs = pd.Series([keys[code] if code >= 0 else [] for code in codes], dtype=object).explode().dropna()
+    return pairs.index.to_numpy(dtype=np.intp), pairs.to_list()
+
+
+def add_topic_counts(data, hitRows, hitTopics):
+
+    """
+    Adds one to the topic column of every
+    (row position, topic) hit pair in a
+    single scatter, so a topic found twice
+    in a row counts twice.
+    """
+
+    columns = list(dict.fromkeys(hitTopics))
+    if not columns:
+        return data
+    colIdx = {topic: idx for idx, topic in enumerate(columns)}
+    counts = data[columns].to_numpy()
+    np.add.at(counts, (np.asarray(hitRows, dtype=np.intp), [colIdx[topic] for topic in hitTopics]), 1)
+    data[columns] = counts
+    return data
+
+
+def aggregate_topics(data, groupCols, topics, mode='sum'):
+
+    """
+    Aggregates the topic columns by the
+    group columns. The mode is one of
+    AGGREGATIONS: 'sum' and 'max' are the
+    plain groupby reductions, while
+    'signed_extremum' keeps, per group and
+    topic, whichever of the max and min
+    has the larger magnitude (the max wins
+    ties), computed over the whole matrices.
+    """
+
+    grouped = data.groupby(groupCols, as_index=False)
+    if mode == 'sum':
+        return grouped.sum()
+    if mode == 'max':
+        return grouped.max()
+    if mode != 'signed_extremum':
+        raise ValueError('Unknown aggregation mode: {}'.format(mode))
+    pos = grouped.max()
+    neg = grouped.min()
+    posValues = pos[topics].to_numpy(dtype=float)
+    negValues = neg[topics].to_numpy(dtype=float)
+    pos[topics] = np.where(np.abs(negValues) > posValues, negValues, posValues)
+    return pos
@@ -0,0 +1,110 @@
+import os, json, hashlib
+import pandas as pd
+
+"""
+
+Content-addressed cache for the stages of pipeline.py. A stage's output is
+stored as <cache>/<key>.parquet, where the key is a hash of everything the
+stage depends on (input file contents, parameters, topic list and the key
+of the stage before it), so a stage is only re-run when one of those
+changes. The least recently used entries are evicted once the cache grows
+past its size limit.
+
+"""
+
+
+BLOCK_SIZE = 1024 * 1024
+
+
+def file_hash(document):
+
+    """
+    Returns the SHA-256 of a file's
+    contents (None if no file is given).
+    """
+
+    if document is None:
+        return None
+    digest = hashlib.sha256()
+    with open(document, 'rb') as doc:
+        for block in iter(lambda: doc.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fingerprint(stage, **inputs):
+
+    """
+    Returns the cache key of a stage from
+    its name and inputs (which must be
+    JSON serialisable).
+    """
+
+    return hashlib.sha256(json.dumps([stage, inputs], sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _path(cache, key):
+    return os.path.join(cache, key + '.parquet')
+
+
+def load(cache, key):
+
+    """
+    Returns the cached output of a stage,
+    or None if it is not in the cache.
+    """
+
+    path = _path(cache, key)
+    if not os.path.exists(path):
+        return None
+    try:
+        data = pd.read_parquet(path)
+    except Exception as error:
+        print('\r\nWARNING: Could not read cache entry {} ({}); re-running the stage.'.format(path, error))
+        return None
+    os.utime(path)
+    return data
+
+
+def store(cache, key, data, maxBytes):
+
+    """
+    Stores the output of a stage and then
+    evicts the least recently used entries
+    until the cache fits in maxBytes.
+    Frames that cannot be written as
+    Parquet are simply not cached.
+    """
+
+    os.makedirs(cache, exist_ok=True)
+    path = _path(cache, key)
+    try:
+        data.to_parquet(path + '.tmp', index=True)
+    except Exception as error:
+        print('\r\nWARNING: Could not cache stage output ({}).'.format(error))
+        if os.path.exists(path + '.tmp'):
+            os.remove(path + '.tmp')
+        return
+    os.replace(path + '.tmp', path)
+    evict(cache, maxBytes, keep=path)
+
+
+def evict(cache, maxBytes, keep=None):
+
+    """
+    Deletes the least recently used cache
+    entries until the cache holds at most
+    maxBytes (the entry just stored is
+    always kept).
+    """
+
+    entries = [os.path.join(cache, name) for name in os.listdir(cache) if name.endswith('.parquet')]
+    entries = sorted(entries, key=os.path.getmtime)
+    total   = sum(os.path.getsize(entry) for entry in entries)
+    for entry in entries:
+        if total <= maxBytes:
+            break
+        if entry == keep:
+            continue
+        total -= os.path.getsize(entry)
+        os.remove(entry)
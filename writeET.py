@@ -1,4 +1,5 @@
-import csv, argparse, sys, re, os
+import csv, argparse, sys, re, os, io, time, mmap, locale, sqlite3
+from concurrent.futures import ProcessPoolExecutor
         
 maxInt = sys.maxsize
 decrement = True
@@ -9,6 +10,16 @@ while decrement:
     except OverflowError:
         maxInt = int(maxInt/20)
         decrement = True
+
+""" Event tags, raw or escaped; the name stops at whitespace, '>', '/' or an entity. """
+ET_REGEX          = re.compile(r'(?:<|&lt;)(?:TRUE)?EVENT_([^\s>/&]+)')
+SUFFIX_REGEX      = re.compile(r'_(N|P|X)$')
+PROGRESS_SECONDS  = 5
+CHECK_RECORDS     = 4
+RANGES_PER_WORKER = 4
+MAX_RANGE_BYTES   = 64 * 1024 * 1024
+SLOTS             = ', metadata_analyst, metadata_orgid, metadata_organization, metadata_hyperlink, metadata_domicile, metadata_region, metadata_broad, metadata_city, metadata_date, metadata_specific, SectionName'
+ENTITY_SOURCES    = ['entity_lists', 'modifyET', 'modifyET_stp']
             
 def _clean_slashes(fileName):
     fileName = os.path.normpath(fileName)
@@ -19,56 +30,159 @@ def _clean_slashes(fileName):
     return fileName
     
 def _read(document):
-    xmlData = []
-    r = csv.reader(open(document, 'r', newline=''), delimiter=',')
-    for row in r:
-        #if len(row) != 0:
-        xmlData.append(row[6])
-    return xmlData
+    with open(document, 'r', newline='') as doc:
+        for row in csv.reader(doc, delimiter=','):
+            if len(row) > 6:
+                yield row[6]
 
-def _clean(data):
-    data = data.replace('&lt;', '<')
-    data = data.replace('&gt;', '>')
-    data = data.replace('&quot;', '"')
-    data = re.sub(r'=([0-9_.-]+)(>| )', r'="\1"\2', data)
-    data = re.sub(r'(negated=|future=|modal=|prop__[a-z]+=)(true|false)', r'\1"\2"', data)
-    return data
-    
-def _find_all_ets(data, eventTypes):
-    ets = re.findall(r'<[TRUE]*EVENT_[^ ]+', data)
-    for et in ets:
-        if et[0:4] == '<TRU':
-            et = et[11:]
-        else:
-            et = et[7:]
-        et = re.sub(r'_(N|P|X)$', '', et)
-        et = et.replace('_', ' ')
-        if et not in eventTypes:
-            eventTypes.append(et)
+def _event_type(name, names):
+    try:
+        return names[name]
+    except KeyError:
+        et = names[name] = SUFFIX_REGEX.sub('', name).replace('_', ' ')
+        return et
+
+def _find_all_ets(data, eventTypes, names):
+    for name in ET_REGEX.findall(data):
+        et = _event_type(name, names)
+        eventTypes[et] = eventTypes.get(et, 0) + 1
     return eventTypes
 
-def _write_et(directory, eventTypes, tag):
-    document = directory + '\eventtypes' + tag + '.txt'
-    slots    = ', metadata_analyst, metadata_orgid, metadata_organization, metadata_hyperlink, metadata_domicile, metadata_region, metadata_broad, metadata_city, metadata_date, metadata_specific, SectionName\r\n'
+def _lines(view, start, end):
+    encoding = locale.getpreferredencoding(False)
+    while start < end:
+        stop = view.find(b'\n', start, end)
+        stop = end if stop == -1 else stop + 1
+        yield view[start:stop].decode(encoding)
+        start = stop
+
+def _is_record_start(view, offset, numFields):
+    try:
+        for rowNum, row in enumerate(csv.reader(_lines(view, offset, len(view)))):
+            if len(row) not in (0, numFields):
+                return False
+            if rowNum + 1 >= CHECK_RECORDS:
+                break
+    except csv.Error:
+        return False
+    return True
+
+def _record_start(view, offset, numFields):
+    while offset < len(view):
+        offset = view.find(b'\n', offset)
+        if offset == -1:
+            break
+        offset += 1
+        if _is_record_start(view, offset, numFields):
+            return offset
+    return len(view)
+
+def _split_ranges(document, numRanges):
+    with open(document, 'rb') as doc, mmap.mmap(doc.fileno(), 0, access=mmap.ACCESS_READ) as view:
+        numFields = len(next(csv.reader(_lines(view, 0, len(view))), []))
+        bounds    = [0]
+        for idx in range(1, numRanges):
+            bound = _record_start(view, max(bounds[-1], len(view) * idx // numRanges), numFields)
+            if bound > bounds[-1]:
+                bounds.append(bound)
+        bounds.append(len(view))
+    return sorted(set(bounds))
+
+def _scan_range(document, start, end):
+    eventTypes = {}
+    names      = {}
+    xmlNum     = 0
+    with open(document, 'rb') as doc:
+        doc.seek(start)
+        text = doc.read(end - start).decode(locale.getpreferredencoding(False))
+    for row in csv.reader(io.StringIO(text, newline=''), delimiter=','):
+        if len(row) > 6:
+            xmlNum    += 1
+            eventTypes = _find_all_ets(row[6], eventTypes, names)
+    return eventTypes, xmlNum
+
+def _scan_parallel(document, workers):
+    if os.path.getsize(document) == 0:
+        return {}, 0
+    bounds     = _split_ranges(document, max(workers * RANGES_PER_WORKER, os.path.getsize(document) // MAX_RANGE_BYTES))
+    eventTypes = {}
+    xmlNum     = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(_scan_range, [document] * (len(bounds) - 1), bounds[:-1], bounds[1:])
+        for rangeNum, (rangeEts, rangeXmls) in enumerate(results, 1):
+            for et, count in rangeEts.items():
+                eventTypes[et] = eventTypes.get(et, 0) + count
+            xmlNum += rangeXmls
+            print(f'Finished range {str(rangeNum)} out of {str(len(bounds) - 1)}')
+    return eventTypes, xmlNum
+
+def _write_et(directory, eventTypes, tag, suffix=None):
+    document = os.path.join(directory, 'eventtypes' + tag + '.txt')
     with open(document, 'w') as doc:
         for et in eventTypes:
-            doc.write(et + slots)
-    
-def _main(document, directory, tag):
+            if suffix is None:
+                doc.write(et + SLOTS + '\r\n')
+            else:
+                doc.write(et + SLOTS + suffix + '\n\n')
+
+def _entity_suffix(source):
+    if source is None:
+        return None
+    if source == 'modifyET':
+        import modifyET
+        return modifyET.append_text
+    if source == 'modifyET_stp':
+        import modifyET_stp
+        return modifyET_stp.append_text
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'entity_lists'), 'r') as doc:
+        entities = [entity.strip() for line in doc for entity in line.split(',') if entity.strip() != '']
+    return ', ' + ', '.join(entities)
+
+def _update_catalogue(catalogue, batch, eventTypes, minCount=1):
+    print('Updating event type catalogue...')
+    with sqlite3.connect(catalogue) as conn:
+        conn.execute('CREATE TABLE IF NOT EXISTS event_types (event_type TEXT PRIMARY KEY, first_batch TEXT)')
+        conn.execute('CREATE TABLE IF NOT EXISTS counts (event_type TEXT, batch TEXT, count INTEGER, PRIMARY KEY (event_type, batch))')
+        conn.executemany('INSERT OR IGNORE INTO event_types VALUES (?, ?)', [(et, batch) for et in eventTypes])
+        conn.execute('DELETE FROM counts WHERE batch = ?', (batch,))
+        conn.executemany('INSERT INTO counts VALUES (?, ?, ?)', [(et, batch, count) for et, count in eventTypes.items()])
+        rows = conn.execute('SELECT e.event_type, COALESCE(SUM(c.count), 0) FROM event_types e LEFT JOIN counts c '
+                            'ON c.event_type = e.event_type GROUP BY e.event_type ORDER BY MIN(e.rowid)').fetchall()
+    kept = {et: count for et, count in rows if count >= minCount}
+    print(f'Catalogue holds {str(len(rows))} event types; {str(len(rows) - len(kept))} pruned below {str(minCount)} occurrences')
+    return kept
+
+def _main(document, directory, tag, workers=1, catalogue=None, batch=None, minCount=1, entities=None):
     print('Reading results document...')
-    allXmls    = _read(document)
-    eventTypes = []
-    for xmlNum, xml in enumerate(allXmls):
-        print(f'Working on document {str(xmlNum + 1)} out of {str(len(allXmls))}')
-        xml = _clean(xml)
-        eventTypes = _find_all_ets(xml, eventTypes)
-    _write_et(directory, eventTypes, tag)
+    if workers > 1:
+        eventTypes, xmlNum = _scan_parallel(document, workers)
+    else:
+        eventTypes = {}
+        names      = {}
+        lastPrint  = time.perf_counter()
+        xmlNum     = 0
+        for xmlNum, xml in enumerate(_read(document), 1):
+            eventTypes = _find_all_ets(xml, eventTypes, names)
+            if time.perf_counter() - lastPrint >= PROGRESS_SECONDS:
+                print(f'Working on document {str(xmlNum)}')
+                lastPrint = time.perf_counter()
+    print(f'Found {str(len(eventTypes))} event types in {str(xmlNum)} documents')
+    if catalogue is not None:
+        eventTypes = _update_catalogue(catalogue, batch or document, eventTypes, minCount)
+    elif minCount > 1:
+        eventTypes = {et: count for et, count in eventTypes.items() if count >= minCount}
+    _write_et(directory, eventTypes, tag, _entity_suffix(entities))
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Makes an eventtypes.txt based on all events in results file.')
     parser.add_argument('--document', type=str, help='the results file.', required=True)
     parser.add_argument('--tag', type=str, help='what to add to the end of the eventtypes.txt file name.', required=True)
+    parser.add_argument('--workers', type=int, default=1, help='number of processes scanning byte ranges of the results file in parallel (default 1).')
+    parser.add_argument('--catalogue', type=str, help='SQLite event type catalogue to update with this batch; the eventtypes file then lists every catalogued event type.')
+    parser.add_argument('--batch', type=str, help='name of this batch in the catalogue (default the results file path).')
+    parser.add_argument('--mincount', type=int, default=1, help='leave out event types with fewer occurrences (across the catalogue, if given) (default 1).')
+    parser.add_argument('--entities', choices=ENTITY_SOURCES, help='append the entity list from entity_lists or from modifyET / modifyET_stp to every line.')
     args = parser.parse_args()
     
     (directory, x) = os.path.split(args.document)
-    _main(args.document, directory, args.tag)
\ No newline at end of file
+    _main(args.document, directory, args.tag, args.workers, args.catalogue, args.batch, args.mincount, args.entities)
\ No newline at end of file